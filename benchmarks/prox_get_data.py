@@ -0,0 +1,144 @@
+#!/usr/bin/env python2.7
+
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Micro-benchmark for the PROX reply parser, prox.get_data().
+
+A writer thread pushes a synthetic stream of stats replies, interleaved with
+packet dumps, through a local socket pair. The reader parses it with
+prox.get_data() and reports the parse throughput.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from dats.prox import prox
+
+
+def setup_logging():
+    # get_data() logs at the custom TRACE level that dats.py normally adds.
+    logging.addLevelName(5, 'TRACE')
+    logging.TRACE = 5
+    def trace(msg, *args, **kwargs):
+        logging.log(logging.TRACE, msg, *args, **kwargs)
+    logging.trace = trace
+    logging.basicConfig(level=logging.WARNING)
+
+
+def make_stream(n_replies, dump_every, dump_len):
+    """Build the synthetic PROX output.
+
+    Returns:
+        (str, int, int). The stream, the number of replies and the number of
+        packet dumps it contains.
+    """
+    reply = "1234567890,1234567890,12345,98765432101234,2100000000\n"
+    dump = "pktdump,0,{}\n".format(dump_len) + os.urandom(dump_len) + "\n"
+    parts = []
+    n_dumps = 0
+    for i in range(n_replies):
+        if dump_every and i % dump_every == 0:
+            parts.append(dump)
+            n_dumps += 1
+        parts.append(reply)
+    return ''.join(parts), n_replies, n_dumps
+
+
+def writer(sock, stream, chunk):
+    for i in range(0, len(stream), chunk):
+        sock.sendall(stream[i:i + chunk])
+
+
+def run(stream, n_replies, chunk):
+    rd, wr = socket.socketpair()
+    thread = threading.Thread(target=writer, args=(wr, stream, chunk))
+    thread.daemon = True
+
+    conn = prox(rd)
+    start = time.time()
+    thread.start()
+    for _ in range(n_replies):
+        conn.get_data()
+    elapsed = time.time() - start
+
+    thread.join()
+    n_dumps = 0
+    while conn.get_packet_dump() is not None:
+        n_dumps += 1
+    rd.close()
+    wr.close()
+    return elapsed, n_dumps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prox.get_data() parse throughput")
+    parser.add_argument('-n', '--replies', type=int, default=200000,
+        help='Number of stats replies in the stream (default: 200000)')
+    parser.add_argument('-d', '--dump-every', type=int, default=10,
+        help='Insert a packet dump before every Nth reply, 0 for none (default: 10)')
+    parser.add_argument('-l', '--dump-len', type=int, default=60,
+        help='Packet dump payload length (default: 60)')
+    parser.add_argument('-c', '--chunk', type=int, default=1460,
+        help='Size of the writes on the sending side (default: 1460)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of runs, the best one is reported (default: 3)')
+    args = parser.parse_args()
+
+    setup_logging()
+    stream, n_replies, n_dumps = make_stream(args.replies, args.dump_every, args.dump_len)
+
+    best = None
+    for _ in range(args.repeat):
+        elapsed, parsed_dumps = run(stream, n_replies, args.chunk)
+        if parsed_dumps != n_dumps:
+            print "Parsed {} packet dumps, expected {}".format(parsed_dumps, n_dumps)
+            return 1
+        best = elapsed if best is None else min(best, elapsed)
+
+    print "Stream: {} octets, {} replies, {} packet dumps".format(len(stream), n_replies, n_dumps)
+    print "Best of {}: {:.3f} s, {:.1f} MB/s, {:.0f} messages/s".format(
+        args.repeat, best, len(stream) / best / 1000000, (n_replies + n_dumps) / best)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
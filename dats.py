@@ -44,12 +44,15 @@ from datetime import datetime
 import re
 import imp
 import json
+import time
 
 import dats.config as config
 from dats.doc import res_table
 import dats.remote_control as rc
+import dats.emulator as emulator
 import dats.test
 from dats.test.base import TestBase
+from dats.budget import TimeBudget
 import dats.rstgen as rst
 
 
@@ -81,6 +84,12 @@ def parse_cmdline():
         default=datetime.now().strftime('dats-report-%Y%m%d_%H%M%S/'),
         metavar='DIRECTORY', dest='report_dir',
         help='Where to save the report. A new directory with timestamp in its name is created by default.')
+    parser.add_argument('-e', '--emulate', action='store_true',
+        help='Run against emulated PROX instances instead of the Tester and SUT')
+    parser.add_argument('-b', '--budget', type=float, metavar='MINUTES',
+        help='Time budget of the run. Test settings are trimmed when the tests would take longer. Overrides time_budget from the config file.')
+    parser.add_argument('--resume', action='store_true',
+        help='Reuse the results of trials stored by previous runs instead of running them again')
     parser.add_argument('-v', '--verbose', action='store_true',
         help='Verbose output - set log level of screen to VERBOSE instead of INFO')
     parser.add_argument(
@@ -146,12 +155,21 @@ def setup_logging():
         console.setLevel(logging.VERBOSE)
 
 def execute_inf_commands(sut_inf_commands, sut_information):
-    sut = rc.remote_system(config.getOption('sutUser'), config.getOption('sutIp'),
-            config.getOption('sutDpdkDir'), config.getOption('sutDpdkTgt'),
-            config.getOption('sutProxDir'))
+    if config.getArg('emulate'):
+        sut = emulator.EmulatedSystem('sut', emulator.get_model(),
+                config.getOption('sutUser'), config.getOption('sutIp'),
+                config.getOption('sutDpdkDir'), config.getOption('sutDpdkTgt'),
+                config.getOption('sutProxDir'))
+    else:
+        sut = rc.remote_system(config.getOption('sutUser'), config.getOption('sutIp'),
+                config.getOption('sutDpdkDir'), config.getOption('sutDpdkTgt'),
+                config.getOption('sutProxDir'))
 
     for cmd in sut_inf_commands:
-        output = sut.run_cmd(cmd[0])['out']
+        if len(cmd) > 2 and not cmd[2]:
+            output = sut.run_cmd(cmd[0])['out']
+        else:
+            output = sut.host_fact(cmd[0], lambda: sut.run_cmd(cmd[0])['out'])
         label = cmd[1] if len(cmd) > 1 else cmd[0]
         output_list = output.split('\n')
 
@@ -192,19 +210,23 @@ def main():
 
 
     # SUT information
+    # The output of these commands is cached per host, see
+    # remote_system.host_fact(). Commands with a third element False report
+    # state that can change while the host fingerprint stays the same, such
+    # as firmware, OS and software versions, they are run every time.
     sut_information_hw = [["Hardware"]]
     sut_inf_commands_hw = [
             ["sudo dmidecode --type system | grep 'Product Name' | cut -d: -f2 2> /dev/null", "Platform"],
             ["grep 'model name' /proc/cpuinfo | uniq | cut -d : -f 2 | cut -c 2- 2> /dev/null", "Processor"],
             ["cat /proc/cpuinfo | grep processor | wc -l", "# of cores"],
             ["printf '%d MB' \\$(free -m | grep Mem | tr -s ' ' | cut -d' ' -f2)", "RAM"],
-            [config.getOption("sutDpdkDir") + "/tools/dpdk_nic_bind.py --status | grep  drv=igb_uio | cut -d\\' -f 2", "DPDK ports"],
+            [config.getOption("sutDpdkDir") + "/tools/dpdk_nic_bind.py --status | grep  drv=igb_uio | cut -d\\' -f 2", "DPDK ports", False],
     ]
     sut_information_sw = [["Software"]]
     sut_inf_commands_sw = [
-            ["sudo dmidecode --type bios | grep 'Version' | cut -d: -f2 2> /dev/null", "BIOS version"],
-            ["sudo dmidecode --type bios | grep 'Release Date' | cut -d: -f2 2> /dev/null", "BIOS release date"],
-            ["sed '1!d' /etc/*-release", "OS"],
+            ["sudo dmidecode --type bios | grep 'Version' | cut -d: -f2 2> /dev/null", "BIOS version", False],
+            ["sudo dmidecode --type bios | grep 'Release Date' | cut -d: -f2 2> /dev/null", "BIOS release date", False],
+            ["sed '1!d' /etc/*-release", "OS", False],
             ["uname -rm", "Kernel"],
             ["printf 'v%d.%d' "
                 + "\\$(grep '#define VERSION_MAJOR' "
@@ -213,7 +235,7 @@ def main():
                 + "\\$(grep '#define VERSION_MINOR' "
                 + config.getOption('sutProxDir') + "/version.h "
                 + "| sed 's/[^0-9]//g')",
-              "PROX version"],
+              "PROX version", False],
             ["printf 'v%d.%d.%d' "
                 + "\\$(grep '#define RTE_VER_MAJOR' "
                 + config.getOption('sutDpdkDir') + "/lib/librte_eal/common/include/rte_version.h "
@@ -224,11 +246,11 @@ def main():
                 + "\\$(grep '#define RTE_VER_PATCH_LEVEL' "
                 + config.getOption('sutDpdkDir') + "/lib/librte_eal/common/include/rte_version.h "
                 + "| sed 's/[^0-9]//g') ",
-              "DPDK version"],
+              "DPDK version", False],
             ["cat /sys/devices/system/node/node0/hugepages/hugepages-2048kB/nr_hugepages 2>/dev/null",
-                "Hugepages - 2048kB"],
+                "Hugepages - 2048kB", False],
             ["cat /sys/devices/system/node/node0/hugepages/hugepages-1048576kB/nr_hugepages 2>/dev/null",
-                "Hugepages - 1GB"],
+                "Hugepages - 1GB", False],
             #["uname -a"],
             #["cat /proc/cmdline"],
             #["lspci | grep 82599 | cut -d ' ' -f1", "Niantic ports"],
@@ -271,12 +293,22 @@ def main():
 
     logging.debug("Tests to run: '%s'", "', '".join(tests_to_run))
 
+    budget_minutes = args.budget if args.budget is not None else float(config.getOption('timeBudget'))
+    budget = TimeBudget(budget_minutes * 60 if budget_minutes > 0 else None,
+            os.path.join(config.getOption('cacheDir'), 'history.json'))
+
     test_summaries = []
-    for test in tests_to_run:
+    for index, test in enumerate(tests_to_run):
         if test not in all_tests.keys():
             logging.error("Test '%s' not found. Use the '-l' command line parameter, possibly with '-d' to see the list of available tests.", test)
             continue
 
+        if not budget.plan(test, [t for t in tests_to_run[index:] if t in all_tests]):
+            continue
+        test_name = test
+        test_start = time.time()
+        test_results_all = []
+
         logging.info("Loading test suite %s", test)
 
         # Load test script directly from disk
@@ -298,8 +330,11 @@ def main():
                 test.setup_class()
                 test_results = test.run_all_tests()
                 test.teardown_class()
+                logging.info("Time saved by confirming PROX command completion: %.1f s",
+                        test.prox_time_saved())
                 logging.trace('Test results: %s', test_results)
                 test_summaries.append(dict(test=test, results=test_results))
+                test_results_all += test_results
             except KeyboardInterrupt:
                 logging.error("Test run interrupted by keyboard. Generating partial report.")
                 test_summaries.append(dict(test=test, results=Exception('Test run interrupted by user')))
@@ -311,6 +346,10 @@ def main():
                 logging.error(ex)
                 logging.debug("Exception: %s", traceback.format_exc())
 
+        if test_results_all:
+            budget.record(test_name, time.time() - test_start, test_results_all)
+        budget.restore()
+
     logging.info("--------------------------------------------------------------------------------")
     logging.info("Test summary")
     logging.info("--------------------------------------------------------------------------------")
@@ -346,6 +385,10 @@ def main():
     summary_fh.write(rst.section('Executed tests', '*', True))
     summary_fh.write(rst.simple_table(summ_table))
     summary_fh.write("The tolerated packet loss for these tests was {:g}%.\n\n".format(float(config.getOption('toleratedLoss'))))
+    summary_fh.write(budget.report())
+
+    for host, fingerprint in sorted(rc.prox_builds().items()):
+        sut_information_sw.append(["PROX build on " + host, fingerprint])
 
     summary_fh.write(rst.section('System Under Test information', '*', True))
     summary_fh.write(rst.simple_table(sut_information_hw))
@@ -400,6 +443,11 @@ def main():
 
     logging.info("Report generated in %s", args.report_dir)
 
+    for host, (count, seconds) in sorted(rc.ssh_stats().items()):
+        logging.verbose("%d remote commands to %s took %.1f s, %.3f s per command",
+                count, host, seconds, seconds / count)
+    rc.close_ssh_connections()
+
     ### Flush buffer to logfile
     logging.shutdown()
 
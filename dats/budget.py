@@ -0,0 +1,247 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Time budget for a DATS run.
+
+The duration of every test, and of the searches for each packet size, is kept
+in a history file in the cache directory. When a run has a time budget, the
+cost of the remaining tests is estimated from that history before each test
+starts. If they do not fit in the remaining time, the settings are trimmed
+step by step, see LEVELS: coarser precision, shorter trials, and finally only
+the first packet size, which most KPIs are based on. Tests that do not fit
+even then are skipped. What was trimmed is listed in the report.
+"""
+
+import os
+import os.path as path
+import json
+import math
+import time
+import logging
+
+import dats.config as config
+import dats.rstgen as rst
+
+# Trimming levels: factor for test_precision, factor for test_duration, and
+# whether only the first packet size is tested
+LEVELS = (
+    (1, 1.0, False),
+    (2, 1.0, False),
+    (2, 0.5, False),
+    (4, 0.5, False),
+    (4, 0.5, True),
+)
+
+# Estimates used for tests without history, in seconds
+DEFAULT_SETUP_TIME = 30.0
+DEFAULT_TRIAL_OVERHEAD = 2.0
+
+
+class TimeBudget(object):
+    def __init__(self, seconds, filename):
+        """Start the clock of the run.
+
+        Args:
+            seconds (float): The time budget of the run, or None to only keep
+                the history.
+            filename (str): The history file.
+        """
+        self._seconds = seconds
+        self._filename = filename
+        self._start = time.time()
+        # Options changed by plan(), as read from the config file
+        self._options = dict((option, config.getOption(option))
+                for option in ('testPrecision', 'testDuration', 'pktSizes'))
+        self._original = dict(
+            precision=float(config.getOption('testPrecision')),
+            duration=float(config.getOption('testDuration')),
+            pkt_sizes=map(int, config.getOption('pktSizes').split(',')),
+        )
+        # (test, [str]) for every test that was trimmed or skipped
+        self.trimmed = []
+
+        try:
+            with open(filename) as f:
+                self._history = json.load(f)
+        except (IOError, ValueError):
+            self._history = {}
+
+    def remaining(self):
+        """Return the time left in seconds."""
+        return self._seconds - (time.time() - self._start)
+
+    def settings(self, level):
+        """Return the {precision, duration, pkt_sizes} of a trimming level."""
+        precision_factor, duration_factor, first_only = LEVELS[level]
+        pkt_sizes = self._original['pkt_sizes']
+        return dict(
+            precision=self._original['precision'] * precision_factor,
+            duration=self._original['duration'] * duration_factor,
+            pkt_sizes=pkt_sizes[:1] if first_only else pkt_sizes,
+        )
+
+    def estimate(self, test, settings):
+        """Estimate the time in seconds a test takes with settings.
+
+        The number of trials of a search is assumed to change by one for
+        every factor two in precision. Packet sizes without history are
+        estimated from the closest packet size with history.
+        """
+        history = self._history.get(test)
+        if history is None or not history['pkt_sizes']:
+            trials = math.log(100.0 / settings['precision'], 2) + 2
+            return DEFAULT_SETUP_TIME + len(settings['pkt_sizes']) * trials * \
+                    (settings['duration'] + DEFAULT_TRIAL_OVERHEAD)
+
+        cost = history['setup']
+        known = dict((int(size), entry) for size, entry in history['pkt_sizes'].items())
+        for pkt_size in settings['pkt_sizes']:
+            entry = known[min(known, key=lambda size: abs(size - pkt_size))]
+            trials = entry['trials']
+            if entry['search']:
+                trials = max(1.0, trials + math.log(entry['precision'] / settings['precision'], 2))
+            per_trial = entry['duration'] / entry['trials'] - entry['test_duration'] + settings['duration']
+            cost += trials * per_trial
+        return cost
+
+    def plan(self, test, remaining_tests):
+        """Set the options for a test so that the remaining tests fit.
+
+        The least trimmed level at which the estimated cost of all remaining
+        tests fits in the remaining time is applied with config.setOption().
+
+        Args:
+            test (str): The test about to run.
+            remaining_tests ([str]): The tests still to run, including test.
+
+        Returns:
+            bool. False if the test does not fit and should be skipped.
+        """
+        if self._seconds is None:
+            return True
+
+        remaining = self.remaining()
+        for level in range(len(LEVELS)):
+            settings = self.settings(level)
+            cost = sum(self.estimate(t, settings) for t in remaining_tests)
+            if cost <= remaining:
+                break
+        logging.verbose("Estimated time of the remaining tests at trimming level %d: %.0f s, %.0f s left",
+                level, cost, remaining)
+
+        if self.estimate(test, settings) > remaining:
+            logging.warning("Skipping test %s, it does not fit in the remaining %.0f s of the time budget",
+                    test, remaining)
+            self.trimmed.append((test, ["skipped, {:.0f} s left".format(max(0, remaining))]))
+            return False
+
+        self.restore()
+        trims = []
+        if settings['precision'] != self._original['precision']:
+            trims.append("test_precision {:g} instead of {:g}".format(settings['precision'], self._original['precision']))
+            config.setOption('testPrecision', settings['precision'])
+        if settings['duration'] != self._original['duration']:
+            trims.append("test_duration {:g} s instead of {:g} s".format(settings['duration'], self._original['duration']))
+            config.setOption('testDuration', settings['duration'])
+        if settings['pkt_sizes'] != self._original['pkt_sizes']:
+            trims.append("packet sizes {} instead of {}".format(
+                    ','.join(map(str, settings['pkt_sizes'])), ','.join(map(str, self._original['pkt_sizes']))))
+            config.setOption('pktSizes', ','.join(map(str, settings['pkt_sizes'])))
+        if trims:
+            logging.info("Trimmed test %s to fit the time budget: %s", test, '; '.join(trims))
+            self.trimmed.append((test, trims))
+        return True
+
+    def record(self, test, duration, results):
+        """Add the time a test took to the history.
+
+        Args:
+            test (str): The test.
+            duration (float): The time the whole test took, in seconds.
+            results ([{...}]): The results of the test. Results with the keys
+                'pkt_size' and 'duration' are counted as the time spent on
+                that packet size, with one trial per result unless it has the
+                key 'trials'.
+        """
+        pkt_sizes = {}
+        for result in results:
+            if 'pkt_size' not in result or 'duration' not in result:
+                continue
+            entry = pkt_sizes.setdefault(str(result['pkt_size']), dict(duration=0.0, trials=0,
+                    search=False, precision=float(config.getOption('testPrecision')),
+                    test_duration=float(config.getOption('testDuration'))))
+            entry['duration'] += result['duration']
+            entry['trials'] += len(result['trials']) if 'trials' in result else 1
+            entry['search'] = entry['search'] or 'trials' in result
+        pkt_sizes = dict((size, entry) for size, entry in pkt_sizes.items() if entry['trials'])
+
+        history = self._history.setdefault(test, dict(setup=DEFAULT_SETUP_TIME, pkt_sizes={}))
+        history['setup'] = max(0.0, duration - sum(entry['duration'] for entry in pkt_sizes.values()))
+        history['pkt_sizes'].update(pkt_sizes)
+
+        try:
+            if not path.isdir(path.dirname(self._filename)):
+                os.makedirs(path.dirname(self._filename))
+            with open(self._filename + '.tmp', 'w') as f:
+                json.dump(self._history, f)
+            os.rename(self._filename + '.tmp', self._filename)
+        except (IOError, OSError), ex:
+            logging.warning("Could not save the test history: %s", ex)
+
+    def restore(self):
+        """Restore the options changed by plan()."""
+        for option, value in self._options.items():
+            config.setOption(option, value)
+
+    def report(self):
+        """Generate the reStructuredText section on the time budget.
+
+        Returns:
+            str. The section, or an empty string if the run had no budget.
+        """
+        if self._seconds is None:
+            return ''
+
+        report = rst.section('Time budget', '*', True)
+        report += "The time budget of this run was {:.0f} s, it took {:.0f} s.\n\n".format(
+                self._seconds, time.time() - self._start)
+        if not self.trimmed:
+            report += "All tests ran with the configured settings.\n\n"
+            return report
+
+        table = [['Test', 'Trimmed']]
+        for test, trims in self.trimmed:
+            table.append([test, '; '.join(trims)])
+        report += rst.simple_table(table)
+        return report
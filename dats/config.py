@@ -47,6 +47,28 @@ configurationOptions = (
     ( 'testPrecision',  'general',  'test_precision', 1.0 ),
     ( 'tests',          'general',  'tests',     None ),
     ( 'toleratedLoss',  'general',  'tolerated_loss', 0.0),
+    ( 'pdrLosses',      'general',  'pdr_losses', '' ),
+    ( 'searchStrategy', 'general',  'search',    'model' ),
+    ( 'warmStart',      'general',  'warm_start', 0 ),
+    ( 'coarseDuration', 'general',  'coarse_duration', 0.0 ),
+    ( 'maxLatency',     'general',  'max_latency', 0.0 ),
+    ( 'latencyStat',    'general',  'latency_stat', 'max' ),
+    ( 'repeat',         'general',  'repeat',    1 ),
+    ( 'repeatNeighbours', 'general', 'repeat_neighbours', 0 ),
+    ( 'ciWidth',        'general',  'ci_width',  2.0 ),
+    ( 'confidence',     'general',  'confidence', 95 ),
+    ( 'rampMode',       'general',  'ramp',      'fixed' ),
+    ( 'rampSweep',      'general',  'ramp_sweep', 0 ),
+    ( 'kneeLatency',    'general',  'knee_latency', 2.0 ),
+    ( 'earlyAbort',     'general',  'early_abort', 0 ),
+    ( 'abortMargin',    'general',  'abort_margin', 1.0 ),
+    ( 'profileTasks',   'general',  'profile_tasks', 0 ),
+    ( 'settleMode',     'general',  'settle',    'poll' ),
+    ( 'settleTimeout',  'general',  'settle_timeout', 5.0 ),
+    ( 'sampleInterval', 'general',  'sample_interval', 0.1 ),
+    ( 'sshPersist',     'general',  'ssh_persist', 600 ),
+    ( 'cacheDir',       'general',  'cache_dir', '.dats-cache' ),
+    ( 'timeBudget',     'general',  'time_budget', 0 ),
 
     ( 'logFile',        'logging',  'file',      'dats.log' ),
     ( 'logFormat',      'logging',  'format',    "%(asctime)-15s %(levelname)-8s %(filename)20s:%(lineno)-3d %(message)s" ),
@@ -67,6 +89,9 @@ configurationOptions = (
     ( 'sutDpdkTgt',     'sut',      'rte_target', 'x86_64-native-linuxapp-gcc' ),
     ( 'sutProxDir',     'sut',      'prox_dir',  '/root/prox' ),
     ( 'sutSocketId',    'sut',      'socket_id',  0 ),
+
+    ( 'emuCapacity',    'emulator', 'capacity',  '64:24,1518:4' ),
+    ( 'emuLatency',     'emulator', 'latency',   5000.0 ),
 )
 
 
@@ -93,6 +118,9 @@ def parseFile(filename):
 def getOption(option):
     return configuration[option]
 
+def setOption(option, value):
+    configuration[option] = value
+
 def getArg(arg):
     global cmdline_args
     return cmdline_args[arg]
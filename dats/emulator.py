@@ -0,0 +1,485 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+PROX emulator, to run DATS without a Tester and SUT.
+
+ProxEmulator accepts connections like a PROX instance and implements the
+commands DATS sends to it. Traffic is not actually generated: the counters
+are computed from the configured speeds and packet sizes, and from a SutModel
+that describes the forwarding capacity and latency of the emulated SUT. The
+emulator of the Tester and the one of the SUT share the SutModel, so the
+counters on both sides agree.
+
+EmulatedSystem is a remote_system that doesn't use ssh or scp, and starts a
+ProxEmulator instead of PROX.
+
+The emulator can also be run on its own, listening on the PROX port:
+    $ python2.7 -m dats.emulator --role tester
+"""
+
+import argparse
+import atexit
+import logging
+import socket
+import SocketServer
+import threading
+import time
+
+from dats.remote_control import remote_system
+import dats.config as config
+
+
+class SutModel(object):
+    def __init__(self, capacity=None, base_latency=5000.0, max_latency=1000000.0):
+        """Create a model of the SUT.
+
+        Args:
+            capacity ({int: float}): Forwarding capacity of the SUT in Mpps,
+                per packet size. The capacity for other packet sizes is
+                interpolated linearly. Defaults to 24 Mpps for 64 byte
+                packets, decreasing to 4 Mpps for 1518 byte packets.
+            base_latency (float): Latency in ns of the idle SUT.
+            max_latency (float): Latency in ns when the SUT is overloaded and
+                its buffers are full.
+        """
+        if capacity is None:
+            capacity = {64: 24.0, 1518: 4.0}
+        self._capacity = sorted(capacity.items())
+        self._base_latency = base_latency
+        self._max_latency = max_latency
+
+        self.lock = threading.RLock()
+        self.tester = None
+        # Packets received, forwarded and dropped by the SUT since start
+        self.rx = 0.0
+        self.tx = 0.0
+        self.dropped = 0.0
+        self.load = 0.0
+
+    def capacity_pps(self, pkt_size):
+        """Return the forwarding capacity in packets per second."""
+        points = self._capacity
+        if pkt_size <= points[0][0]:
+            return points[0][1] * 1000000
+        for (size_lo, mpps_lo), (size_hi, mpps_hi) in zip(points, points[1:]):
+            if pkt_size <= size_hi:
+                fraction = float(pkt_size - size_lo) / (size_hi - size_lo)
+                return (mpps_lo + fraction * (mpps_hi - mpps_lo)) * 1000000
+        return points[-1][1] * 1000000
+
+    def latency(self):
+        """Return the (min, max, avg) latency in ns for the current load."""
+        if self.load >= 1:
+            avg = self._max_latency
+        else:
+            # Queueing delay grows with load / (1 - load), like in an M/M/1
+            # queue, until the buffers are full.
+            avg = min(self._base_latency * (1 + self.load / (1 - self.load)), self._max_latency)
+        return self._base_latency * 0.8, min(avg * 2, self._max_latency), avg
+
+    def sync(self):
+        """Bring the counters up to date with the traffic of the Tester."""
+        if self.tester is not None:
+            self.tester.advance()
+
+    def forward(self, offered, pkt_size, seconds):
+        """Account for offered packets sent by the Tester during seconds.
+
+        Returns:
+            float. The fraction of the offered packets that is forwarded.
+        """
+        if offered <= 0 or seconds <= 0:
+            self.load = 0.0
+            return 1.0
+
+        rate = offered / seconds
+        capacity = self.capacity_pps(pkt_size)
+        self.load = rate / capacity
+        fraction = min(1.0, capacity / rate)
+        self.rx += offered
+        self.tx += offered * fraction
+        self.dropped += offered * (1 - fraction)
+        return fraction
+
+
+class _Core(object):
+    def __init__(self):
+        self.running = False
+        self.speed = 0.0
+        self.pkt_size = 64
+        self.count = 0
+        self.rx = 0.0
+        self.tx = 0.0
+        self.dumps = 0
+
+
+class ProxEmulator(object):
+    HZ = 2000000000
+
+    def __init__(self, model, role='tester', host='127.0.0.1', port=8474, n_ports=4, n_cores=56):
+        """Create an emulator, start() makes it accept connections.
+
+        Args:
+            model (SutModel): The model of the SUT, shared with the emulator
+                for the other side.
+            role (str): 'tester' to generate traffic, 'sut' to forward it.
+            host (str), port (int): Address to listen on. Port 0 selects a
+                free port, see port().
+            n_ports (int): Number of ports of the emulated system.
+            n_cores (int): Number of cores of the emulated system.
+        """
+        self._model = model
+        self._role = role
+        self._address = (host, port)
+        self._n_ports = n_ports
+        self._cores = dict((core, _Core()) for core in range(n_cores))
+        self._server = None
+        self._connections = []
+        self._start_time = time.time()
+        self._last_update = self._start_time
+        # Counter values at the last 'reset stats' on the SUT
+        self._sut_base = (0.0, 0.0, 0.0)
+        self._port_last = {}
+
+        if role == 'tester':
+            model.tester = self
+
+    def start(self):
+        """Start accepting connections in a background thread."""
+        emulator = self
+
+        class Handler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                emulator._connections.append(self.request)
+                # Each reply is written on its own. Without TCP_NODELAY, the
+                # replies to a pipelined batch stall on delayed ACKs.
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        break
+                    reply = emulator.handle_command(line.strip())
+                    if reply:
+                        self.wfile.write(reply)
+                        self.wfile.flush()
+
+        SocketServer.ThreadingTCPServer.allow_reuse_address = True
+        self._server = SocketServer.ThreadingTCPServer(self._address, Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='prox-emulator')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.stop)
+        logging.debug("PROX emulator (%s) listening on port %d", self._role, self.port())
+
+    def stop(self):
+        """Stop accepting connections."""
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        # Unblock the handler threads, so they terminate.
+        for conn in self._connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self._connections = []
+        if self._model.tester is self:
+            self._model.tester = None
+
+    def port(self):
+        """Return the TCP port the emulator listens on."""
+        return self._server.server_address[1]
+
+    def tsc(self):
+        return int((time.time() - self._start_time) * self.HZ)
+
+    def advance(self):
+        """Update the counters for the traffic since the last update."""
+        with self._model.lock:
+            now = time.time()
+            seconds = now - self._last_update
+            self._last_update = now
+            if self._role != 'tester':
+                return
+
+            offered = {}
+            for core_id, core in self._cores.items():
+                if not core.running or core.speed <= 0:
+                    continue
+                pkts = core.speed / 100.0 * 1250000000 / (core.pkt_size + 20) * seconds
+                if core.count > 0:
+                    pkts = max(0, min(pkts, core.count - core.tx))
+                offered[core_id] = pkts
+
+            total = sum(offered.values())
+            pkt_size = 64
+            if total > 0:
+                pkt_size = sum(self._cores[core_id].pkt_size * pkts for core_id, pkts in offered.items()) / total
+            fraction = self._model.forward(total, pkt_size, seconds)
+            for core_id, pkts in offered.items():
+                self._cores[core_id].tx += pkts
+                self._cores[core_id].rx += pkts * fraction
+
+    def _core_list(self, spec):
+        """Parse a PROX core list like '1,2,4-6' or 'all'."""
+        if spec == 'all':
+            return sorted(self._cores.keys())
+        cores = []
+        for part in spec.split(','):
+            if '-' in part:
+                first, last = part.split('-')
+                cores.extend(range(int(first), int(last) + 1))
+            else:
+                cores.append(int(part))
+        return cores
+
+    def _core(self, core_id):
+        return self._cores.setdefault(int(core_id), _Core())
+
+    def _totals(self):
+        """Return (rx, tx, dropped) counted by this system."""
+        if self._role == 'tester':
+            rx = sum(core.rx for core in self._cores.values())
+            tx = sum(core.tx for core in self._cores.values())
+            return rx, tx, 0.0
+        base_rx, base_tx, base_dropped = self._sut_base
+        return self._model.rx - base_rx, self._model.tx - base_tx, self._model.dropped - base_dropped
+
+    def _port_counters(self, port):
+        """Return (rx, tx, missed) of a port."""
+        rx, tx, dropped = self._totals()
+        share = 1.0 / self._n_ports
+        if self._role == 'tester':
+            # Tester cores transmit in order on the ports
+            rx = tx = 0.0
+            for core_id, core in self._cores.items():
+                if (core_id - 1) % self._n_ports == port:
+                    rx += core.rx
+                    tx += core.tx
+            return rx, tx, 0.0
+        return rx * share, tx * share, dropped * share
+
+    def handle_command(self, line):
+        """Execute a single PROX command.
+
+        Returns:
+            str. The reply including the terminating \\n, None for commands
+            that don't reply.
+        """
+        logging.trace("PROX emulator (%s) command: [%s]", self._role, line)
+        self._model.sync()
+        self.advance()
+        args = line.split()
+        if not args:
+            return None
+
+        with self._model.lock:
+            tsc = self.tsc()
+            cmd = args[0]
+            if cmd == 'tot' and args[1:2] == ['stats']:
+                rx, tx, _ = self._totals()
+                return "{},{},{},{}\n".format(int(rx), int(tx), tsc, self.HZ)
+            elif cmd == 'tot' and args[1:2] == ['ierrors']:
+                _, _, dropped = self._totals()
+                return "{},{},{}\n".format(int(dropped), tsc, self.HZ)
+            elif cmd == 'core' and args[1:2] == ['stats']:
+                core_id = int(args[2])
+                if self._role == 'tester':
+                    core = self._core(core_id)
+                    rx, tx, drop = core.rx, core.tx, 0.0
+                else:
+                    # The overloaded SUT drops packets at the NICs, which
+                    # count them as missed, not on the cores. The cores only
+                    # receive the packets they forward.
+                    _, tx, _ = self._port_counters((core_id - 1) % self._n_ports)
+                    rx, drop = tx, 0.0
+                return "{},{},{},{},{}\n".format(int(rx), int(tx), int(drop), tsc, self.HZ)
+            elif cmd == 'port_stats':
+                port = int(args[1])
+                rx, tx, missed = self._port_counters(port)
+                last_rx, last_tx, last_missed = self._port_last.get(port, (0.0, 0.0, 0.0))
+                self._port_last[port] = (rx, tx, missed)
+                size = 64
+                return "{},{},{},{},{},{},{},{},{},{},{},{}\n".format(
+                    0, int(missed - last_missed),
+                    int((rx - last_rx) * size), int((tx - last_tx) * size),
+                    int(rx - last_rx), int(tx - last_tx),
+                    int(rx), int(tx), 0, int(missed), tsc, self.HZ)
+            elif cmd == 'lat' and args[1:2] == ['stats']:
+                lat_min, lat_max, lat_avg = self._model.latency()
+                return "{},{},{},{},{}\n".format(int(lat_min), int(lat_max), int(lat_avg), tsc, self.HZ)
+            elif cmd in ('start', 'stop') and len(args) > 1:
+                for core_id in self._core_list(args[1]):
+                    self._core(core_id).running = cmd == 'start'
+                if cmd == 'start':
+                    return self._flush_dumps()
+            elif cmd == 'speed':
+                self._core(args[1]).speed = float(args[3])
+            elif cmd == 'pkt_size':
+                # PROX takes the packet size without CRC
+                self._core(args[1]).pkt_size = int(args[3]) + 4
+            elif cmd == 'count':
+                self._core(args[1]).count = int(args[3])
+            elif cmd == 'dump_rx':
+                self._core(args[1]).dumps += int(args[3])
+            elif cmd == 'reset' and args[1:2] == ['stats']:
+                for core in self._cores.values():
+                    core.rx = core.tx = 0.0
+                self._port_last = {}
+                if self._role != 'tester':
+                    self._sut_base = (self._model.rx, self._model.tx, self._model.dropped)
+            elif cmd in ('set', 'reset'):
+                # 'set value' and 'reset values' don't affect the counters
+                pass
+            else:
+                logging.debug("PROX emulator (%s): ignoring unknown command [%s]", self._role, line)
+        return None
+
+    def _flush_dumps(self):
+        """Return packet dumps for the cores that have dump_rx pending."""
+        reply = ''
+        for core_id, core in sorted(self._cores.items()):
+            while core.dumps > 0:
+                core.dumps -= 1
+                payload = '\0' * (core.pkt_size - 4)
+                reply += "pktdump,{},{}\n{}\n".format((core_id - 1) % self._n_ports, len(payload), payload)
+        return reply or None
+
+
+# Model shared by all emulated systems of a DATS run
+_model = None
+
+
+def parse_capacity(spec):
+    """Parse a capacity like '64:24,1518:4' into {64: 24.0, 1518: 4.0}."""
+    return dict((int(size), float(mpps)) for size, mpps in
+                (point.split(':') for point in spec.split(',')))
+
+
+def get_model():
+    """Return the SutModel shared by the emulated Tester and SUT.
+
+    The model is created from the [emulator] section of the config file.
+    """
+    global _model
+    if _model is None:
+        _model = SutModel(parse_capacity(config.getOption('emuCapacity')),
+                float(config.getOption('emuLatency')))
+    return _model
+
+
+class EmulatedSystem(remote_system):
+    # Output of DPDK's cpu_layout.py for 2 sockets with 14 cores and
+    # 2 hyperthreads each.
+    CPU_LAYOUT = "\n".join(
+        ["cores =  [" + ", ".join(str(core) for core in range(14)) + "]",
+         "sockets =  [0, 1]",
+         ""] +
+        ["Core {} [{}, {}] [{}, {}]".format(core, core, core + 28, core + 14, core + 42)
+         for core in range(14)])
+
+    def __init__(self, role, model, user, ip, dpdk_dir, dpdk_target, prox_dir):
+        """Create an emulated remote system.
+
+        Args:
+            role (str): 'tester' or 'sut'.
+            model (SutModel): The model shared with the other emulated system.
+            The other arguments are the same as for remote_system.
+        """
+        remote_system.__init__(self, user, '127.0.0.1', dpdk_dir, dpdk_target, prox_dir)
+        self._role = role
+        self._model = model
+        self._emulator = None
+
+    def run_cmd(self, cmd):
+        """Return canned output for the commands DATS runs on the remotes"""
+        logging.debug("Emulated command: '%s'", cmd)
+        out = 'emulated'
+        if 'cpu_layout.py' in cmd:
+            out = self.CPU_LAYOUT
+        elif 'grep processor' in cmd:
+            out = '56'
+        return dict(out=out, ret=0)
+
+    def run_cmd_forked(self, cmd):
+        self.run_cmd(cmd)
+        return 0
+
+    def scp(self, local, remote):
+        logging.debug("Emulated SCP: %s -> %s", local, remote)
+        return dict(out='', ret=0)
+
+    def run_prox(self, prox_args):
+        """Start a PROX emulator and connect to it"""
+        if self._emulator is not None:
+            self._emulator.stop()
+        logging.debug("Starting PROX emulator (%s) with args [%s]", self._role, prox_args)
+        self._emulator = ProxEmulator(self._model, self._role, self._ip, 0)
+        self._emulator.start()
+        self._prox_port = self._emulator.port()
+        return self.connect_prox()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PROX emulator for DATS")
+    parser.add_argument('--role', choices=['tester', 'sut'], default='tester',
+        help='Emulate the Tester or the SUT, tester by default')
+    parser.add_argument('--host', default='0.0.0.0',
+        help='Address to listen on, 0.0.0.0 by default')
+    parser.add_argument('--port', type=int, default=8474,
+        help='Port to listen on, 8474 by default')
+    parser.add_argument('--capacity', default='64:24,1518:4',
+        help='SUT capacity in Mpps per packet size, 64:24,1518:4 by default')
+    parser.add_argument('--latency', type=float, default=5000.0,
+        help='Latency of the idle SUT in ns, 5000 by default')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.trace = logging.debug
+
+    model = SutModel(parse_capacity(args.capacity), args.latency)
+    emulator = ProxEmulator(model, args.role, args.host, args.port)
+    emulator.start()
+    logging.info("PROX emulator (%s) listening on port %d", args.role, emulator.port())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -145,3 +145,46 @@ plot '/tmp/histplot.dat' using 2 ti col axis x1y1, '' u 3:xticlabels(1) ti col a
     gnuplot_file.close()
 
     os.system("gnuplot /tmp/gnuplot.script")
+
+
+def line_plot(series, xlabel, ylabel, output_path):
+    '''
+    Creates a line plot image with one line per series on the given output path
+
+    series is a list of (title, [(x, y), ...]) tuples.
+    '''
+    if len(series) < 1:
+        raise Exception("Need at least 1 series to create line plot")
+
+    # Export series to data file, one data block per series
+    data = ''
+    for _, points in series:
+        for x, y in points:
+            data += str(x) + ' ' + str(y) + '\n'
+        data += '\n\n'
+
+    # Write data to temp. file, so gnuplot can pick it up for rendering
+    temp_file = open('/tmp/lineplot.dat', 'w')
+    temp_file.write(data)
+    temp_file.close()
+
+    gnuplot_script = '''
+reset
+set key outside right
+set xlabel "{}"
+set ylabel "{}"
+set yrange [0:]
+set term png size 800,600
+set output "{}"
+plot '''.format(xlabel, ylabel, output_path)
+
+    gnuplot_script += ', '.join(
+        "'/tmp/lineplot.dat' index {} using 1:2 with lines title \"{}\"".format(i, title)
+        for i, (title, _) in enumerate(series))
+    gnuplot_script += "\n"
+
+    gnuplot_file = open("/tmp/gnuplot.script", 'w')
+    gnuplot_file.write(gnuplot_script)
+    gnuplot_file.close()
+
+    os.system("gnuplot /tmp/gnuplot.script")
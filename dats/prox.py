@@ -32,23 +32,83 @@
 #
 
 import select
+import threading
+import time
 from time import sleep
 import logging
-import array
+
+from dats.stats import StatsSnapshot, StatsBatch
 
 class prox(object):
-    def __init__(self, prox_socket):
+    # Size of a single recv() on the PROX socket. Stats replies are short, but
+    # packet dumps and pipelined replies arrive in bursts, so read big chunks.
+    RECV_SIZE = 65536
+
+    # Fixed delays in seconds after commands whose effect is not reported by
+    # PROX. They are used as is when fixed_delays is set, otherwise they are
+    # only the reference for the time saved by confirming completion.
+    FIXED_DELAYS = dict(
+        stop=3,
+        start=3,
+        reset_stats=1,
+        pkt_size=1,
+        dump_rx=1.5,
+    )
+
+    def __init__(self, prox_socket, fixed_delays=False, settle_timeout=5.0, settle_interval=0.25):
         """ creates new prox instance """
         self._sock = prox_socket
+        self._fixed_delays = fixed_delays
+        self._settle_timeout = settle_timeout
+        self._settle_interval = settle_interval
+        self._time_saved = 0.0
         # sleep(1)
         # self.put_data("tot ierrors tot\n")
         # recv = self.get_data()
         self._pkt_dumps = []
+        # Receive buffer, persistent across calls to get_data(). Everything
+        # before _rpos has been consumed already.
+        self._rbuf = bytearray()
+        self._rpos = 0
+        # Serializes commands and their replies, so that the connection can
+        # be shared with a background stats sampler.
+        self._lock = threading.RLock()
+        # TSC frequency, known from the first stats reply that carries it.
+        self._hz = None
 
     def get_socket(self):
         """ get the socket connected to the remote instance """
         return self._sock
 
+    def _fill_buffer(self, timeout):
+        """Append the next chunk of data on the socket to the receive buffer.
+
+        Returns:
+            bool. False if no data arrived within timeout seconds or if the
+            connection was closed, True otherwise.
+        """
+        # recv() is blocking, so avoid calling it when no data is waiting.
+        ready = select.select([self._sock], [], [], timeout)
+        if not ready[0]:
+            logging.debug("No data waiting on socket")
+            return False
+
+        logging.debug("Reading from socket")
+        dat = self._sock.recv(self.RECV_SIZE)
+        if not dat:
+            logging.debug("Connection closed by remote")
+            return False
+
+        # Drop the consumed part of the buffer. Slicing creates a new
+        # bytearray, so memoryviews handed out for earlier packet dumps keep
+        # pointing at valid data and never block resizing of the buffer.
+        if self._rpos:
+            self._rbuf = self._rbuf[self._rpos:]
+            self._rpos = 0
+        self._rbuf += dat
+        logging.trace("Receive buffer holds %d octets", len(self._rbuf))
+        return True
+
     def get_data(self, pkt_dump_only=False, timeout=1):
         """ read data from the socket """
         # This method behaves slightly differently depending on whether it is
@@ -62,72 +122,67 @@ class prox(object):
         # of 1 line.
         #
         # - Response for a command (pkt_dump_only = 0):
-        #   1) Read response from the socket until \n (end of message)
-        #   2a) If the response is a packet dump header (starts with "pktdump,"):
-        #     - Read the packet payload and store the packet dump for later
-        #       retrieval.
-        #     - Reset the state and restart from 1). Eventually state 2b) will
-        #       be reached and the function will return.
-        #   2b) If the response is not a packet dump:
+        #   1) Find the next \n (end of message) in the receive buffer, reading
+        #      from the socket until one is available
+        #   2a) If the line is a packet dump header (starts with "pktdump,"):
+        #     - Wait until the full payload is buffered and store the packet
+        #       dump for later retrieval.
+        #     - Restart from 1). Eventually state 2b) will be reached and the
+        #       function will return.
+        #   2b) If the line is not a packet dump:
         #     - Return the received message as a string
         #
         # - Explicit request to read a packet dump (pkt_dump_only = 1):
         #   - Read the dump header and payload
         #   - Store the packet dump for later retrieval
         #   - Return True to signify a packet dump was successfully read
-        ret_str = None
-        dat = ""
-        done = 0
-        while done == 0:
-            # recv() is blocking, so avoid calling it when no data is waiting.
-            ready = select.select([self._sock], [], [], timeout)
-            if ready[0]:
-                logging.debug("Reading from socket")
-                dat = self._sock.recv(256)
-                ret_str = ""
-            else:
-                logging.debug("No data waiting on socket")
-                done = 1
-            logging.trace("Iterating over input buffer (%d octets)", len(dat))
-
-            i = 0
-            while i < len(dat) and (done == 0):
-                if dat[i] == '\n':
-                    # Terminating \n for a string reply encountered.
-                    if ret_str.startswith('pktdump,'):
-                        logging.trace("Packet dump header read: [%s]", ret_str)
-                        # The line is a packet dump header. Parse it, read the
-                        # packet payload, store the dump for later retrieval.
-                        # Skip over the packet dump and continue processing: a
-                        # 1-line response may follow the packet dump.
-                        _, port_id, data_len = ret_str.split(',', 2)
-                        port_id, data_len = int(port_id), int(data_len)
-
-                        data_start = i + 1      # + 1 to skip over \n
-                        data_end = data_start + data_len
-                        pkt_payload = array.array('B', map(ord, dat[data_start:data_end]))
-                        pkt_dump = PacketDump(port_id, data_len, pkt_payload)
-                        self._pkt_dumps.append(pkt_dump)
-
-                        # Reset state. Increment i with payload length and add
-                        # 1 for the trailing \n.
-                        ret_str = ""
-                        i += data_len + 1
-
-                        if pkt_dump_only:
-                            # Return boolean instead of string to signal
-                            # successful reception of the packet dump.
-                            logging.trace("Packet dump stored, returning")
-                            ret_str = True
-                            done = 1
-                    else:
-                        # Regular 1-line message. Stop reading from the socket.
-                        logging.trace("Regular response read")
-                        done = 1
-                else:
-                    ret_str += dat[i]
-
-                i = i + 1
+        #
+        # Data following the message that is returned stays in the receive
+        # buffer and is handed out by the next call, as are incomplete lines.
+        with self._lock:
+            ret_str = None
+            while True:
+                eol = self._rbuf.find(b'\n', self._rpos)
+                if eol == -1:
+                    if not self._fill_buffer(timeout):
+                        break
+                    continue
+
+                line = str(self._rbuf[self._rpos:eol])
+                if not line.startswith('pktdump,'):
+                    # Regular 1-line message.
+                    logging.trace("Regular response read")
+                    self._rpos = eol + 1
+                    ret_str = line
+                    break
+
+                # The line is a packet dump header. Parse it and store the
+                # packet payload for later retrieval. Continue processing
+                # afterwards: a 1-line response may follow the packet dump.
+                _, port_id, data_len = line.split(',', 2)
+                port_id, data_len = int(port_id), int(data_len)
+
+                data_start = eol + 1      # + 1 to skip over \n
+                data_end = data_start + data_len
+                if len(self._rbuf) < data_end + 1:
+                    # Payload or its trailing \n not fully received yet. The
+                    # header is parsed again once more data is buffered.
+                    if not self._fill_buffer(timeout):
+                        break
+                    continue
+
+                logging.trace("Packet dump header read: [%s]", line)
+                pkt_payload = memoryview(self._rbuf)[data_start:data_end]
+                self._pkt_dumps.append(PacketDump(port_id, data_len, pkt_payload))
+                # Skip over the payload and the trailing \n.
+                self._rpos = data_end + 1
+
+                if pkt_dump_only:
+                    # Return boolean instead of string to signal successful
+                    # reception of the packet dump.
+                    logging.trace("Packet dump stored, returning")
+                    ret_str = True
+                    break
 
         logging.debug("Received data from socket: [%s]", ret_str)
         return ret_str
@@ -135,7 +190,82 @@ class prox(object):
     def put_data(self, to_send):
         """ send data to the remote intance """
         logging.debug("Sending data to socket: [%s]", to_send.rstrip('\n'))
-        self._sock.sendall(to_send)
+        with self._lock:
+            self._sock.sendall(to_send)
+
+    def pipeline(self, cmds):
+        """Send a batch of commands at once and read all their replies.
+
+        All commands are written with a single sendall(), after which the
+        replies are read in the order the commands were sent. A batch thus
+        costs one round trip to PROX instead of one per command, and the
+        values in the replies are sampled as close together as possible.
+
+        Args:
+            cmds ([str]): Commands that each produce a 1-line reply, without
+                the terminating \n.
+
+        Returns:
+            [str]. The reply for each command, in order.
+        """
+        if not cmds:
+            return []
+        with self._lock:
+            self.put_data("\n".join(cmds) + "\n")
+            return [self.get_data() for _ in cmds]
+
+    def time_saved(self):
+        """Return the time in seconds saved by not using the fixed delays."""
+        return self._time_saved
+
+    def _sync(self):
+        """Wait until PROX has handled all commands sent so far.
+
+        PROX handles the commands on a connection in order, so once the reply
+        to a query arrives, all preceding commands have been executed.
+        """
+        self.pipeline(["tot stats"])
+
+    def _wait_stable(self, query):
+        """Poll query() until it returns the same value twice in a row.
+
+        Returns:
+            bool. True if the value became stable, False on timeout.
+        """
+        deadline = time.time() + self._settle_timeout
+        prev = query()
+        while time.time() < deadline:
+            sleep(self._settle_interval)
+            cur = query()
+            if cur == prev:
+                return True
+            prev = cur
+        return False
+
+    def _settle(self, cmd, query=None):
+        """Wait until the last command has taken effect.
+
+        With fixed delays, this simply sleeps for FIXED_DELAYS[cmd]. Otherwise
+        it waits until PROX has handled the command and, if a query is given,
+        until the counters it returns have stopped changing.
+
+        Args:
+            cmd (str): Key in FIXED_DELAYS for the command that was sent.
+            query (callable): Optional function returning the counters that
+                must be stable before the command is considered complete.
+        """
+        delay = self.FIXED_DELAYS[cmd]
+        if self._fixed_delays:
+            sleep(delay)
+            return
+
+        start = time.time()
+        self._sync()
+        if query is not None and not self._wait_stable(query):
+            logging.verbose("Counters still changing %g s after '%s'", self._settle_timeout, cmd)
+        elapsed = time.time() - start
+        self._time_saved += delay - elapsed
+        logging.debug("'%s' confirmed after %.2f s (fixed delay: %g s)", cmd, elapsed, delay)
 
     def get_packet_dump(self):
         """ get the next packet dump """
@@ -154,14 +284,16 @@ class prox(object):
         """ stop all cores on the remote instance """
         logging.debug("Stop all")
         self.put_data("stop all\n")
-        sleep(3)
+        self._settle('stop', lambda: self.tot_stats()[:2])
 
     def stop(self, cores, task=-1):
         """ stop specific cores on the remote instace """
         logging.debug("Stopping cores %s", cores)
         task_string = "" if task == -1 else " {}".format(task)
         self.put_data("stop " + str(cores)[1:-1].replace(" ", "") + task_string + "\n")
-        sleep(3)
+        stats_task = 0 if task == -1 else task
+        self._settle('stop', lambda: [stats[:3] for _, stats in
+                sorted(self.multi_core_stats(cores, stats_task)[0].items())])
 
     def start_all(self):
         """ start all cores on the remote instance """
@@ -173,38 +305,36 @@ class prox(object):
         """ start specific cores on the remote instance """
         logging.debug("Starting cores %s", cores)
         self.put_data("start " + str(cores)[1:-1].replace(" ", "") + "\n")
-        sleep(3)
+        # PROX waits for the cores to pick up the start request before it
+        # handles the next command, so no need to poll any counters.
+        self._settle('start')
 
     def reset_stats(self):
         """ reset the statistics on the remote instance """
         logging.debug("Reset stats")
         self.put_data("reset stats\n")
-        sleep(1)
+        self._settle('reset_stats')
 
     def set_pkt_size(self, cores, pkt_size):
         """ set the packet size to generate on the remote instance """
         logging.debug("Set packet size for core(s) %s to %d", cores, pkt_size)
-        for core in cores:
-            self.put_data("pkt_size " + str(core) + " 0 " + str(pkt_size - 4) + "\n")
-        sleep(1)
+        self.put_data("".join("pkt_size " + str(core) + " 0 " + str(pkt_size - 4) + "\n" for core in cores))
+        self._settle('pkt_size')
 
     def set_value(self, cores, offset, value, length):
         """ set value on the remote instance """
         logging.debug("Set value for core(s) %s to '%s' (length %d), offset %d", cores, value, length, offset)
-        for core in cores:
-            self.put_data("set value " + str(core) + " 0 " + str(offset) + " " + str(value) + " " + str(length) + "\n")
+        self.put_data("".join("set value " + str(core) + " 0 " + str(offset) + " " + str(value) + " " + str(length) + "\n" for core in cores))
 
     def reset_values(self, cores):
         """ reset values on the remote instance """
         logging.debug("Set value for core(s) %s", cores)
-        for core in cores:
-            self.put_data("reset values " + str(core) + " 0\n")
+        self.put_data("".join("reset values " + str(core) + " 0\n" for core in cores))
 
     def set_speed(self, cores, speed):
         """ set speed on the remote instance """
         logging.debug("Set speed for core(s) %s to %g", cores, speed)
-        for core in cores:
-            self.put_data("speed " + str(core) + " 0 " + str(speed) + "\n")
+        self.put_data("".join("speed " + str(core) + " 0 " + str(speed) + "\n" for core in cores))
 
     def slope_speed(self, cores_speed, duration, n_steps=0):
         """will start to increase speed from 0 to N where N is taken from
@@ -241,27 +371,29 @@ class prox(object):
         logging.debug("Set packets per sec for core(s) %s to %g%% of line rate (packet size: %d)", cores, pps, pkt_size)
         # speed in percent of line-rate
         speed = float(pps)/(1250000000/(pkt_size + 20))
-        for core in cores:
-            self.put_data("speed " + str(core) + " 0 " + str(speed) + "\n")
+        self.put_data("".join("speed " + str(core) + " 0 " + str(speed) + "\n" for core in cores))
 
     def lat_stats(self, cores, task=0):
         """Get the latency statistics from the remote system"""
         lat_min = [0 for e in range(255)]
         lat_max = [0 for e in range(255)]
         lat_avg = [0 for e in range(255)]
-        for core in cores:
-            self.put_data("lat stats " + str(core) + " " + str(task) + " " +  "\n")
-            ret = self.get_data().split(",")
+        replies = self.pipeline(["lat stats {} {}".format(core, task) for core in cores])
+        for core, reply in zip(cores, replies):
+            ret = reply.split(",")
             lat_min[core] = int(ret[0])
             lat_max[core] = int(ret[1])
             lat_avg[core] = int(ret[2])
         return lat_min, lat_max, lat_avg
 
     def hz(self):
-        self.put_data("tot stats\n")
-        recv = self.get_data()
-        hz = int(recv.split(",")[3])
-        return hz
+        """Return the TSC frequency of the remote system.
+
+        The frequency does not change, so PROX is only asked once.
+        """
+        if self._hz is None:
+            self.tot_snapshot()
+        return self._hz
 
     # Deprecated
     def rx_stats(self, cores, task=0):
@@ -269,53 +401,132 @@ class prox(object):
 
     def core_stats(self, cores, task=0):
         """Get the receive statistics from the remote system"""
+        return self.multi_core_stats(cores, task)[1]
+
+    def multi_core_stats(self, cores, task=0):
+        """Get the statistics of several cores in a single round trip.
+
+        Returns:
+            ({core: (rx, tx, drop, tsc)}, (rx, tx, drop, tsc)). The counters
+            of each core, and the counters summed over all cores. The tsc of
+            the sum is the one of the last core.
+        """
+        per_core = {}
         rx = tx = drop = tsc = 0
-        for core in cores:
-            self.put_data("core stats {} {}\n".format(core, task))
-            ret = self.get_data().split(",")
-            rx += int(ret[0])
-            tx += int(ret[1])
-            drop += int(ret[2])
-            tsc = int(ret[3])
-        return rx, tx, drop, tsc
+        replies = self.pipeline(["core stats {} {}".format(core, task) for core in cores])
+        for core, reply in zip(cores, replies):
+            ret = map(int, reply.split(",")[:4])
+            per_core[core] = tuple(ret)
+            rx += ret[0]
+            tx += ret[1]
+            drop += ret[2]
+            tsc = ret[3]
+        return per_core, (rx, tx, drop, tsc)
 
     def port_stats(self, ports):
         """get counter values from a specific port"""
+        return self.multi_port_stats(ports)[1]
+
+    def multi_port_stats(self, ports):
+        """Get the counters of several ports in a single round trip.
+
+        Returns:
+            ({port: [int, ...]}, [int, ...]). The 12 counters of each port, and
+            the counters summed over all ports.
+        """
+        per_port = {}
         tot_result = [0] * 12
-        for port in ports:
-            self.put_data("port_stats {}\n".format(port))
-            ret = map(int, self.get_data().split(","))
+        replies = self.pipeline(["port_stats {}".format(port) for port in ports])
+        for port, reply in zip(ports, replies):
+            ret = map(int, reply.split(","))
+            per_port[port] = ret
             tot_result = map(sum, zip(tot_result, ret))
-        return tot_result
+        return per_port, tot_result
 
     def tot_stats(self):
         """Get the total statistics from the remote system"""
-        self.put_data("tot stats\n")
-        recv = self.get_data()
-        tot_rx = int(recv.split(",")[0])
-        tot_tx = int(recv.split(",")[1])
-        tsc = int(recv.split(",")[2])
-        hz = int(recv.split(",")[3])
-        return tot_rx, tot_tx, tsc
+        snapshot = self.tot_snapshot()
+        return snapshot.rx, snapshot.tx, snapshot.tsc
+
+    def tot_snapshot(self):
+        """Get the total statistics as a StatsSnapshot."""
+        snapshot = StatsSnapshot.from_tot_stats(self.pipeline(["tot stats"])[0])
+        self._hz = snapshot.hz
+        return snapshot
+
+    def core_snapshot(self, cores, task=0):
+        """Get the statistics of a task on several cores as one StatsSnapshot.
+
+        Returns:
+            StatsSnapshot. The counters summed over all cores.
+        """
+        hz = self.hz()
+        replies = self.pipeline(["core stats {} {}".format(core, task) for core in cores])
+        return sum(StatsSnapshot.from_core_stats(reply, hz) for reply in replies)
+
+    def port_snapshot(self, ports):
+        """Get the counters of several ports as one StatsSnapshot.
+
+        Returns:
+            StatsSnapshot. The counters summed over all ports.
+        """
+        replies = self.pipeline(["port_stats {}".format(port) for port in ports])
+        return sum(StatsSnapshot.from_port_stats(reply) for reply in replies)
+
+    def snapshot(self, ports=(), cores=(), task=0, ierrors=False, tasks=()):
+        """Get the counters of several ports and cores in a single batch.
+
+        All counters are requested in one round trip, together with the total
+        statistics whose tsc stamps the batch. Batches taken at the start and
+        at the end of a trial thus delimit the same window for every counter.
+
+        Args:
+            ports ([int]): Ports to read the counters of.
+            cores ([int]): Cores to read the counters of task of.
+            task (int): Task on the cores.
+            ierrors (bool): Whether to read the total number of packets the
+                NICs dropped on receive into the total statistics too.
+            tasks ([(int, int)]): Other tasks to read the counters of, as
+                (core, task) pairs.
+
+        Returns:
+            StatsBatch.
+        """
+        cmds = (["tot stats"]
+                + ["port_stats {}".format(port) for port in ports]
+                + ["core stats {} {}".format(core, task) for core in cores]
+                + ["core stats {} {}".format(core, task_id) for core, task_id in tasks])
+        if ierrors:
+            cmds.append("tot ierrors tot")
+        replies = self.pipeline(cmds)
+        tot = StatsSnapshot.from_tot_stats(replies[0])
+        self._hz = tot.hz
+        if ierrors:
+            tot.ierrors = int(replies.pop().split(",")[0])
+        port_replies = replies[1:len(ports) + 1]
+        core_replies = replies[len(ports) + 1:len(ports) + len(cores) + 1]
+        task_replies = replies[len(ports) + len(cores) + 1:]
+        return StatsBatch(tot,
+                dict((port, StatsSnapshot.from_port_stats(reply)) for port, reply in zip(ports, port_replies)),
+                dict((core, StatsSnapshot.from_core_stats(reply, tot.hz)) for core, reply in zip(cores, core_replies)),
+                dict((task, StatsSnapshot.from_core_stats(reply, tot.hz)) for task, reply in zip(tasks, task_replies)))
 
     def tot_ierrors(self):
         """Get the total ierrors from the remote system"""
-        self.put_data("tot ierrors tot\n")
-        recv = self.get_data()
+        recv = self.pipeline(["tot ierrors tot"])[0]
         tot_ierrors = int(recv.split(",")[0])
         tsc = int(recv.split(",")[0])
         return tot_ierrors, tsc
 
     def set_count(self, count, cores):
         """Set the number of packets to send on the specified core"""
-        for core in cores:
-            self.put_data("count {} 0 {}\n".format(core, count))
+        self.put_data("".join("count {} 0 {}\n".format(core, count) for core in cores))
 
     def dump_rx(self, core_id, task_id=0, count=1):
         """Activate dump on rx on the specified core"""
         logging.debug("Activating dump on RX for core %d, task %d, count %d", core_id, task_id, count)
         self.put_data("dump_rx {} {} {}\n".format(core_id, task_id, count))
-        sleep(1.5)     # Give PROX time to set up packet dumping
+        self._settle('dump_rx')     # Give PROX time to set up packet dumping
 
 
 
@@ -353,8 +564,9 @@ class PacketDump(object):
                 returned.
 
         Returns:
-            [int, int, ...]. Each int represents the ordinal value of a byte in
-            the packet payload.
+            memoryview. A view on the received bytes, no data is copied. Use
+            tolist() to get a list of ints, where each int represents the
+            ordinal value of a byte in the packet payload.
         """
         if start is None:
             start = 0
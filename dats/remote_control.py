@@ -33,31 +33,144 @@
 
 import os, os.path as path
 import thread
+import threading
 import time
 import socket
 import logging
 import errno
+import atexit
+import shutil
+import tempfile
+import hashlib
+import tarfile
+import json
+import re
 
 from dats.prox import prox
 import dats.config as config
 
 
-def ssh(user, ip, cmd):
-    """Execute ssh command"""
-    logging.debug("Command to execute over SSH: '%s'", cmd)
+# Directory holding the ControlMaster sockets of this run, one per host.
+_control_dir = None
+
+# Fingerprint of the PROX build used on each user@host.
+_prox_builds = {}
+
+# Content hashes of the files in the upload cache, per user@host.
+_uploads = {}
+_uploads_lock = threading.Lock()
+
+# Fingerprints and cached facts, per user@host. See host_fact().
+_host_fingerprints = {}
+_host_facts = {}
+_host_facts_lock = threading.RLock()
+
+# Number of commands and total time spent in them, per user@host.
+_ssh_stats = {}
+_ssh_stats_lock = threading.Lock()
+
+
+def _ssh_options():
+    """Return the options passed to ssh and scp.
+
+    Unless disabled in the config file, all commands to the same host share a
+    single master connection, so the TCP and key exchange overhead is paid
+    once per run instead of once per command.
+    """
+    global _control_dir
     ssh_options = ""
     ssh_options += "-o StrictHostKeyChecking=no "
     ssh_options += "-o UserKnownHostsFile=/dev/null "
     ssh_options += "-o LogLevel=error "
-    running = os.popen("ssh " + ssh_options + " " + user + "@" + ip + " \"" + cmd + "\"")
+
+    persist = int(config.getOption('sshPersist'))
+    if persist > 0:
+        if _control_dir is None:
+            _control_dir = tempfile.mkdtemp(prefix='dats-ssh-')
+            atexit.register(close_ssh_connections)
+        ssh_options += "-o ControlMaster=auto "
+        ssh_options += "-o ControlPath=" + path.join(_control_dir, "%r@%h:%p") + " "
+        ssh_options += "-o ControlPersist=" + str(persist) + " "
+
+    return ssh_options
+
+def _run_timed(host, cmd):
+    """Run a local command and account its duration to host"""
+    start = time.time()
+    running = os.popen(cmd)
     ret = {}
     ret['out'] = running.read().strip()
     ret['ret'] = running.close()
     if ret['ret'] is None:
         ret['ret'] = 0
+    elapsed = time.time() - start
+
+    with _ssh_stats_lock:
+        stats = _ssh_stats.setdefault(host, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+    logging.debug("Command to %s completed in %.3f s with status %d", host, elapsed, ret['ret'])
 
     return ret
 
+def ssh(user, ip, cmd):
+    """Execute ssh command"""
+    logging.debug("Command to execute over SSH: '%s'", cmd)
+    host = user + "@" + ip
+    return _run_timed(host, "ssh " + _ssh_options() + " " + host + " \"" + cmd + "\"")
+
+def ssh_stats():
+    """Return a dict mapping user@host to (number of commands, total seconds)"""
+    with _ssh_stats_lock:
+        return dict((host, tuple(stats)) for host, stats in _ssh_stats.items())
+
+def _file_hash(filename):
+    """Return the MD5 hash of the content of a local file"""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _host_facts_path(host):
+    return path.join(config.getOption('cacheDir'), 'hosts', host + '.json')
+
+def _load_host_facts(host):
+    """Load the cached facts of host from disk"""
+    try:
+        with open(_host_facts_path(host)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def _save_host_facts(host, facts):
+    """Save the cached facts of host to disk"""
+    filename = _host_facts_path(host)
+    try:
+        if not path.isdir(path.dirname(filename)):
+            os.makedirs(path.dirname(filename))
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(facts, f)
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError), ex:
+        logging.warning("Could not save the cached facts of %s: %s", host, ex)
+
+def prox_builds():
+    """Return a dict mapping user@host to the fingerprint of its PROX build"""
+    return dict(_prox_builds)
+
+def close_ssh_connections():
+    """Close the master connections and remove their control sockets"""
+    global _control_dir
+    if _control_dir is None:
+        return
+
+    for host in ssh_stats().keys():
+        os.system("ssh -o ControlPath=" + path.join(_control_dir, "%r@%h:%p") \
+                + " -O exit " + host + " >/dev/null 2>&1")
+    shutil.rmtree(_control_dir, ignore_errors=True)
+    _control_dir = None
+
 def ssh_check_quit(obj, user, ip, cmd):
     ret = ssh(user, ip, cmd)
     if ret['ret'] != 0:
@@ -66,6 +179,15 @@ def ssh_check_quit(obj, user, ip, cmd):
         exit(-1)
 
 class remote_system:
+    # Flags passed to make when building PROX
+    PROX_BUILD_FLAGS = "HW_DIRECT_STATS=y"
+
+    # File in the PROX build directory holding the fingerprint of the build
+    PROX_BUILD_STAMP = "build/.dats_build"
+
+    # Directory on the remote system holding uploaded files by content hash
+    UPLOAD_CACHE = "/tmp/dats-cache"
+
     def __init__(self, user, ip, dpdk_dir, dpdk_target, prox_dir):
         self._ip          = ip
         self._user        = user
@@ -75,6 +197,9 @@ class remote_system:
         self._dpdk_bind_script = self._dpdk_dir + "/tools/dpdk_nic_bind.py"
         self._err = False
         self._err_str = None
+        self._abort_str = None
+        self._prox_instances = []
+        self._prox_port   = 8474
 
     def run_cmd(self, cmd):
         """Execute command over ssh"""
@@ -160,33 +285,89 @@ class remote_system:
         # it might not be able to allocate hugepages, because they are still
         # being freed. Hence the -w switch.
         self.run_cmd("sudo killall -w prox 2>/dev/null")
+        self.build_prox()
 
-        prox_cmd = "export TERM=xterm; export RTE_SDK=" + self._dpdk_dir + "; " \
-            + "export RTE_TARGET=" + self._dpdk_target + ";" \
-            + " cd " + self._prox_dir + "; make HW_DIRECT_STATS=y -j50; sudo " \
+        prox_cmd = "export TERM=xterm; cd " + self._prox_dir + "; sudo " \
             + "./build/prox " + prox_args
         self._err = False
+        self._check_abort()
         logging.debug("Starting PROX with command [%s]", prox_cmd)
         thread.start_new_thread(ssh_check_quit, (self, self._user, self._ip, prox_cmd))
         prox = None
         logging.debug("Waiting for PROX to settle")
-        
+
         # try connecting to prox for 120s
-        connection_timeout = 120
+        deadline = time.time() + 120
         while prox is None:
-            time.sleep(1)
-            connection_timeout -= 1
+            time.sleep(0.25)
             try:
                 prox = self.connect_prox()
             except:
                 pass
             if self._err == True:
                 raise Exception(self._err_str)
-            if connection_timeout == 0:
+            self._check_abort()
+            if prox is None and time.time() > deadline:
                 raise Exception("Failed to connect to prox, please check if system " \
-                        + self._ip + " accepts connections on port 8474")
+                        + self._ip + " accepts connections on port " + str(self._prox_port))
         return prox
 
+    def prox_fingerprint(self):
+        """Return the fingerprint of the PROX build for the current sources.
+
+        The fingerprint covers the PROX source revision including local
+        changes outside the build directory (or the size and modification
+        time of all files when the PROX directory is not a git checkout), the
+        DPDK directory and target, and the build flags.
+        """
+        sources = self.run_cmd("cd " + self._prox_dir + " && " \
+                + "(git rev-parse HEAD && git status --porcelain -- . ':!build' && git diff HEAD" \
+                + " || find . -path ./build -prune -o -type f -printf '%P %T@ %s\\n' | sort)" \
+                + " 2>/dev/null | md5sum")['out']
+        fingerprint = hashlib.md5()
+        for part in (sources, self._dpdk_dir, self._dpdk_target, self.PROX_BUILD_FLAGS):
+            fingerprint.update(part + "\n")
+        return fingerprint.hexdigest()
+
+    def build_prox(self):
+        """Build PROX, unless the existing binary matches the sources.
+
+        The fingerprint of the last successful build is stored next to the
+        binary on the remote system. PROX is only rebuilt when the
+        fingerprint of the current sources differs from it.
+
+        Returns:
+            str. The fingerprint of the PROX build.
+        """
+        fingerprint = self.prox_fingerprint()
+        host = self._user + "@" + self._ip
+        stamp = self.run_cmd("cd " + self._prox_dir + " && test -x build/prox && cat " + self.PROX_BUILD_STAMP)
+        if stamp['ret'] == 0 and stamp['out'] == fingerprint:
+            logging.debug("PROX build %s on %s is up to date", fingerprint, host)
+        else:
+            logging.verbose("Building PROX on %s", host)
+            ret = self.run_cmd("export RTE_SDK=" + self._dpdk_dir + "; " \
+                    + "export RTE_TARGET=" + self._dpdk_target + "; " \
+                    + "cd " + self._prox_dir + " && make " + self.PROX_BUILD_FLAGS + " -j50 2>&1" \
+                    + " && echo " + fingerprint + " > " + self.PROX_BUILD_STAMP)
+            if ret['ret'] != 0:
+                raise Exception("Failed to build PROX on " + self._ip + ": " + ret['out'][-1000:])
+
+        _prox_builds[host] = fingerprint
+        return fingerprint
+
+    def abort_prox(self, reason):
+        """Make a pending run_prox() call fail with the given reason.
+
+        This is used to give up on one system as soon as PROX failed to start
+        on another one. Call with reason None to clear a previous abort.
+        """
+        self._abort_str = reason
+
+    def _check_abort(self):
+        if self._abort_str is not None:
+            raise Exception(self._abort_str)
+
     def run_prox_with_config(self, configfile, prox_args, sysname="system"):
         """Run prox on the remote system with the given config file"""
         logging.debug("Setting up PROX to run with args '%s' and config file %s", prox_args, configfile)
@@ -198,7 +379,7 @@ class remote_system:
 
         conf_remotepath = "/tmp/" + configfile
         logging.debug("Config file local path: '%s', remote name: '%s'", conf_localpath, conf_remotepath)
-        self.scp(conf_localpath, conf_remotepath)
+        self.upload([(conf_localpath, conf_remotepath)])
 
         #sock = self.connect_prox()
         sock = self.run_prox(prox_args + " -f " + conf_remotepath)
@@ -211,73 +392,204 @@ class remote_system:
         """Connect to the prox instance on the remote system"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock.connect((self._ip, 8474))
-            return prox(sock)
+            sock.connect((self._ip, self._prox_port))
+            instance = prox(sock,
+                    fixed_delays=config.getOption('settleMode') == 'sleep',
+                    settle_timeout=float(config.getOption('settleTimeout')))
+            self._prox_instances.append(instance)
+            return instance
         except:
             raise Exception("Failed to connect to PROX on " + self._ip)
         return None
 
+    def prox_time_saved(self):
+        """Return the time saved over fixed delays by all PROX connections"""
+        return sum(instance.time_saved() for instance in self._prox_instances)
+
     def scp(self, local, remote):
         """Copy a file from the local system to the remote system"""
         logging.debug("Initiating SCP: %s -> %s", local, remote)
-        cmd = "scp " + local + " " + self._user + "@" + self._ip + ":" + remote
+        host = self._user + "@" + self._ip
+        cmd = "scp " + _ssh_options() + local + " " + host + ":" + remote
         logging.debug("SCP command: [%s]", cmd)
-        running = os.popen(cmd)
-        ret = {}
-        ret['out'] = running.read().strip()
-        ret['ret'] = running.close()
-        if ret['ret'] is None:
-            ret['ret'] = 0
+        ret = _run_timed(host, cmd)
 
         logging.debug("SCP status: %d, output: [%s]", ret['ret'], ret['out'])
 
         return ret
 
-    def copy_extra_config(self, filename):
-        logging.debug("Copying extra config file %s", filename)
-        local = path.join(config.getArg('tests_dir'), 'prox-configs', filename)
-        if not path.isfile(local):
-            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), local)
-
-        remote = "/tmp/" + filename
-        logging.debug("Config file local path: '%s', remote name: '%s'", local, remote)
-        self.scp(local, remote)
+    def upload(self, files):
+        """Copy files to the remote system, skipping content it already has.
+
+        Uploaded files are kept in UPLOAD_CACHE on the remote system, named
+        by the MD5 hash of their content. Only files whose content is not in
+        the cache yet are transferred, all in a single compressed archive.
+        Each file is then copied from the cache to its destination.
+
+        Args:
+            files ([(str, str)]): (local path, remote path) pairs.
+
+        Raises:
+            Exception: if the files could not be copied.
+        """
+        host = self._user + "@" + self._ip
+        files = [(_file_hash(local), local, remote) for local, remote in files]
+
+        for attempt in range(2):
+            cached = self._cached_uploads(host)
+            missing = dict((digest, local) for digest, local, _ in files if digest not in cached)
+            logging.debug("Uploading %d of %d files to %s", len(missing), len(files), host)
+            if missing:
+                self._upload_archive(missing)
+                with _uploads_lock:
+                    cached.update(missing.keys())
+
+            ret = self.run_cmd(" && ".join("cp -f " + self.UPLOAD_CACHE + "/" + digest + " " + remote
+                    for digest, _, remote in files))
+            if ret['ret'] == 0:
+                return
+
+            # The cache was probably cleaned up on the remote system, so
+            # list it again and retry.
+            with _uploads_lock:
+                _uploads.pop(host, None)
+
+        raise Exception("Failed to copy files to " + self._ip + ": " + ret['out'])
+
+    def _cached_uploads(self, host):
+        """Return the set of content hashes in the upload cache of host"""
+        with _uploads_lock:
+            if host not in _uploads:
+                ret = self.run_cmd("mkdir -p " + self.UPLOAD_CACHE + " && ls " + self.UPLOAD_CACHE)
+                _uploads[host] = set(ret['out'].split()) if ret['ret'] == 0 else set()
+            return _uploads[host]
+
+    def _upload_archive(self, files):
+        """Transfer files to the upload cache in one compressed archive.
+
+        Args:
+            files ({str: str}): Local paths by content hash.
+        """
+        handle, archive = tempfile.mkstemp(prefix='dats-upload-', suffix='.tgz')
+        os.close(handle)
+        try:
+            tar = tarfile.open(archive, 'w:gz')
+            for digest, local in files.items():
+                tar.add(local, arcname=digest)
+            tar.close()
+
+            # Extract into a private directory first, so that an interrupted
+            # transfer never leaves partial files in the cache.
+            remote = self.UPLOAD_CACHE + "/." + path.basename(archive)
+            incoming = remote + ".d"
+            ret = self.scp(archive, remote)
+            if ret['ret'] == 0:
+                ret = self.run_cmd("mkdir -p " + incoming + " && tar xzf " + remote + " -C " + incoming \
+                        + " && mv -f " + incoming + "/* " + self.UPLOAD_CACHE + "/; rm -rf " + remote + " " + incoming)
+            if ret['ret'] != 0:
+                raise Exception("Failed to upload files to " + self._ip + ": " + ret['out'])
+        finally:
+            os.remove(archive)
+
+    def copy_extra_config(self, *filenames):
+        """Copy config files from prox-configs/ to /tmp on the remote system"""
+        files = []
+        for filename in filenames:
+            logging.debug("Copying extra config file %s", filename)
+            local = path.join(config.getArg('tests_dir'), 'prox-configs', filename)
+            if not path.isfile(local):
+                raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), local)
+
+            remote = "/tmp/" + filename
+            logging.debug("Config file local path: '%s', remote name: '%s'", local, remote)
+            files.append((local, remote))
+        self.upload(files)
+
+    def host_fingerprint(self):
+        """Return a fingerprint of the hardware and kernel of the remote system.
+
+        The fingerprint covers the host name, kernel release, kernel command
+        line and /proc/cpuinfo without the varying clock frequencies. It is
+        computed once per host and run.
+        """
+        host = self._user + "@" + self._ip
+        with _host_facts_lock:
+            if host not in _host_fingerprints:
+                _host_fingerprints[host] = self.run_cmd("(hostname; uname -rm; cat /proc/cmdline;" \
+                        + " grep -v MHz /proc/cpuinfo) 2>/dev/null | md5sum")['out'].split(" ")[0]
+            return _host_fingerprints[host]
+
+    def host_fact(self, name, probe):
+        """Return a fact about the remote system, probing it only when needed.
+
+        Facts are cached per host in memory and in the cache_dir directory.
+        They stay valid as long as the host fingerprint does not change, so
+        later test classes and later runs do not probe them again.
+
+        Args:
+            name (str): Name of the fact.
+            probe (callable): Returns the fact if it is not cached. The value
+                must be JSON serializable.
+
+        Returns:
+            The cached or probed value.
+        """
+        host = self._user + "@" + self._ip
+        with _host_facts_lock:
+            facts = _host_facts.get(host)
+            if facts is None:
+                facts = _load_host_facts(host)
+                fingerprint = self.host_fingerprint()
+                if facts.get('fingerprint') != fingerprint:
+                    logging.debug("No valid cached facts for %s with fingerprint %s", host, fingerprint)
+                    facts = dict(fingerprint=fingerprint, facts={})
+                _host_facts[host] = facts
+
+            if name in facts['facts']:
+                logging.debug("Using cached fact '%s' of %s", name, host)
+            else:
+                facts['facts'][name] = probe()
+                _save_host_facts(host, facts)
+            return facts['facts'][name]
 
     def get_cpu_topology(self):
-        cores = ssh(self._user, self._ip, self._dpdk_dir + "/tools/cpu_layout.py | grep 'cores'")
-        sockets = ssh(self._user, self._ip, self._dpdk_dir + "/tools/cpu_layout.py | grep 'sockets'")
-        topology = ssh(self._user, self._ip, self._dpdk_dir + "/tools/cpu_layout.py | grep 'Core [0-9]' | tr -s ' '")
-
-        # convert sockets info to a list
-        sockets = sockets["out"].split("=")[1].replace("[", "").replace("]", "").replace(" ", "").split(",")
-        sockets = map(int, sockets)
-
-        # convert cores info to a list
-        cores = cores["out"].split("=")[1].replace("[", "").replace("]", "").replace(" ", "").split(",")
-        cores = map(int, cores)
-
-        # convert topolgy info to a dictionary
-        topology = topology["out"].split("\n")
-        for i in range(0, len(topology)):
-            core_map = topology[i].replace("Core", "").replace(" ", "").replace("]", "").split("[")
-            core_map[0] = int(core_map[0])
-            for j in range(1, len(core_map)):
-                core_map[j] = core_map[j].split(",")
-                core_map[j] = map(int, core_map[j])
-            topology[i] = [core_map[0], core_map[1:]]
-        topology = dict(topology)
-
-        # create a map of the CPU topology
-        # the structure is as follows:
-        # { socket_num : { core_num :[hyperthread_num, hyperthread_num]}}
-        topology_map = {}
+        """Return the CPU topology of the remote system.
+
+        Returns:
+            {(int, int, int): int}. The CPU ids indexed by (socket, core,
+            hyperthread), where core is the index of the core on its socket
+            and hyperthread is 0 or 1.
+        """
+        rows = self.host_fact('cpu_topology', self._probe_cpu_topology)
+        return dict(((socket, core, ht), cpu) for socket, core, ht, cpu in rows)
+
+    def _probe_cpu_topology(self):
+        """Run DPDK's cpu_layout.py on the remote system.
+
+        Returns:
+            [[int, int, int, int]]. A [socket, core, hyperthread, cpu id] row
+            for every CPU.
+        """
+        layout = self.run_cmd(self._dpdk_dir + "/tools/cpu_layout.py")['out']
+
+        cores = []
+        sockets = []
+        topology = {}
+        for line in layout.split("\n"):
+            line = line.strip()
+            if line.startswith("cores"):
+                cores = map(int, re.findall(r"\d+", line))
+            elif line.startswith("sockets"):
+                sockets = map(int, re.findall(r"\d+", line))
+            elif re.match(r"Core \d+ ", line):
+                # Core 0 [0, 28] [14, 42]: the CPU ids of each socket
+                core = int(line.split()[1])
+                topology[core] = [map(int, cpus.split(",")) for cpus in re.findall(r"\[([\d, ]+)\]", line)]
+
+        rows = []
         for socket in sockets:
-            socket_map = {} 
-            core_id = 0
-            for core in cores:
-                socket_map[core_id] = topology[core][socket]
-                core_id += 1
-            topology_map[socket] = socket_map
-
-        return topology_map
+            for core_id, core in enumerate(cores):
+                for ht, cpu in enumerate(topology[core][socket]):
+                    rows.append([socket, core_id, ht, cpu])
 
+        return rows
@@ -0,0 +1,154 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Background sampling of PROX counters.
+
+A StatsSampler polls the total and port statistics of a PROX instance at a
+fixed interval from a separate thread, while a trial is running. The samples
+are kept in a fixed-size ring, so memory use does not depend on the duration
+of the trial.
+"""
+
+import logging
+import threading
+import time
+
+from dats.stats import StatsBatch, StatsSnapshot
+
+
+class StatsSampler(object):
+    def __init__(self, prox_instance, ports=(), interval=0.1, capacity=4096):
+        """Create a sampler for the given PROX instance.
+
+        Args:
+            prox_instance (prox): The PROX connection to poll. It can be used
+                by other threads while the sampler runs.
+            ports ([int]): The ports whose counters are sampled next to the
+                total statistics.
+            interval (float): Time between samples in seconds.
+            capacity (int): Maximum number of samples kept. When the ring is
+                full, the oldest samples are overwritten.
+        """
+        self._prox = prox_instance
+        self._ports = list(ports)
+        self._interval = interval
+        self._capacity = capacity
+
+        self._ring = [None] * capacity
+        self._count = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Discard earlier samples and start sampling in the background."""
+        self._count = 0
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to finish."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        logging.debug("Stats sampler stopped after %d samples", self._count)
+
+    def _run(self):
+        next_sample = time.time()
+        while not self._stop_event.is_set():
+            try:
+                self._sample()
+            except Exception, ex:
+                logging.warning("Stats sampling aborted: %s", ex)
+                return
+            next_sample += self._interval
+            self._stop_event.wait(max(0, next_sample - time.time()))
+
+    def _sample(self):
+        batch = self._prox.snapshot(ports=self._ports)
+        self._ring[self._count % self._capacity] = (time.time(), batch)
+        self._count += 1
+
+    def samples(self):
+        """Return the samples in the ring, oldest first.
+
+        Returns:
+            [(time, StatsBatch)]. The wall clock time and the total and port
+            counters of each sample.
+        """
+        n = min(self._count, self._capacity)
+        return [self._ring[i % self._capacity]
+                for i in range(self._count - n, self._count)]
+
+    @staticmethod
+    def _window(cur, prev):
+        # Counters that went down were reset in between: they restarted
+        # from 0 rather than wrapped around.
+        if cur.tot.rx < prev.tot.rx or cur.tot.tx < prev.tot.tx:
+            prev = StatsBatch(StatsSnapshot(tsc=prev.tot.tsc, hz=prev.tot.hz),
+                    dict((port, StatsSnapshot(tsc=stats.tsc, hz=stats.hz))
+                            for port, stats in prev.ports.items()))
+        return cur - prev
+
+    def rate_series(self):
+        """Return the rates between consecutive samples.
+
+        The interval lengths are derived from the TSC. Counters that go down,
+        because the statistics were reset, are assumed to restart from 0.
+        Packet loss is computed from the port counters if ports were sampled,
+        from the total statistics otherwise.
+
+        Returns:
+            [(t, tx_mpps, rx_mpps, loss)]. t is the end of the interval in
+            seconds since the first sample, loss is a percentage of the
+            packets sent in the interval.
+        """
+        batches = [batch for _, batch in self.samples()]
+        if len(batches) < 2 or not batches[0].tot.hz:
+            return []
+
+        series = []
+        first = batches[0]
+        for prev, cur in zip(batches, batches[1:]):
+            window = self._window(cur, prev)
+            if window.tot.seconds() <= 0:
+                continue
+            loss = window.port_total().loss() if self._ports else window.tot.loss()
+            series.append(((cur.tot - first.tot).seconds(),
+                    window.tot.tx_pps() / 1000000, window.tot.rx_pps() / 1000000, loss))
+        return series
@@ -0,0 +1,497 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Search strategies for the tests that look for the highest successful value.
+
+A strategy proposes the next value to test based on the outcome of the trials
+run so far. All strategies keep the guarantee of the original binary search:
+the search ends when the highest successful value is less than the precision
+away from the lowest failing value (or the upper bound), and the result is a
+value that was verified by a successful trial.
+"""
+
+import abc
+import logging
+
+import dats.config as config
+import dats.utils as utils
+
+
+class SearchStrategy(object):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, lower, upper, precision, tolerated_loss=0.0):
+        """Initialize the search.
+
+        Args:
+            lower (float): The lower bound of the interval. It is assumed to
+                succeed and is not tested.
+            upper (float): The upper bound of the interval.
+            precision (float): The search ends when the interval is smaller.
+            tolerated_loss (float): The packet loss in % that is tolerated
+                for a trial to succeed.
+        """
+        self.lower = lower
+        self.upper = upper
+        self.precision = precision
+        self.tolerated_loss = tolerated_loss
+        self.trials = 0
+
+    def done(self):
+        """Return True if the interval is smaller than the precision."""
+        return self.upper - self.lower < self.precision
+
+    def next_value(self):
+        """Return the next value to test, or None if the search is done.
+
+        A proposed value outside (lower, upper] is refused, the midpoint of
+        the interval is returned instead.
+        """
+        if self.done():
+            return None
+        value = self.propose()
+        if not self.lower < value <= self.upper:
+            logging.warning("Refusing value %s outside of (%s, %s], testing the midpoint instead",
+                    value, self.lower, self.upper)
+            value = self.lower + (self.upper - self.lower) / 2
+        return value
+
+    @abc.abstractmethod
+    def propose(self):
+        """Return the next value to test, strictly inside (lower, upper].
+
+        Only called while the search is not done.
+        """
+        return
+
+    def estimate(self):
+        """Return the value the strategy predicts to be the maximum, if any.
+
+        Returns:
+            float. The value, strictly inside (lower, upper), or None.
+        """
+        return None
+
+    def add_result(self, value, success, pkt_loss):
+        """Narrow the interval with the outcome of a trial.
+
+        Args:
+            value (float): The value that was tested.
+            success (bool): Whether the trial succeeded.
+            pkt_loss (float): The packet loss in % measured during the trial.
+        """
+        self.trials += 1
+        if success:
+            self.lower = max(self.lower, value)
+        else:
+            self.upper = min(self.upper, value)
+
+
+class Bisection(SearchStrategy):
+    """Plain binary search.
+
+    The first value that is tested, is the maximum value. If that succeeds, no
+    more searching is needed. If it fails, a regular binary search is
+    performed.
+    """
+
+    def __init__(self, lower, upper, precision, tolerated_loss=0.0):
+        super(Bisection, self).__init__(lower, upper, precision, tolerated_loss)
+
+        # The test_value used for the first iteration of binary search
+        # is adjusted so that the delta between this test_value and the
+        # upper bound is a power-of-2 multiple of precision. In the
+        # optimistic situation where this first test_value results in a
+        # success, the binary search will complete on an integer multiple
+        # of the precision, rather than on a fraction of it.
+        adjust = precision
+        while upper - lower > adjust:
+            adjust *= 2
+        self._adjust = (upper - lower - adjust) / 2
+
+        # The adjustment only holds for the whole interval, after a first
+        # trial at its upper bound. That may not be the case when the trials
+        # are proposed by another strategy, e.g. WarmStart.
+        self._adjusted = False
+
+    def propose(self):
+        if self.trials == 0:
+            return self.upper
+        if self._adjusted:
+            return self.lower + (self.upper - self.lower) / 2 + self._adjust
+        return self.lower + (self.upper - self.lower) / 2
+
+    def add_result(self, value, success, pkt_loss):
+        self._adjusted = self.trials == 0 and value == self.upper and not success
+        super(Bisection, self).add_result(value, success, pkt_loss)
+
+
+class ModelGuided(SearchStrategy):
+    """Search guided by the packet loss of failed trials.
+
+    When the SUT is overloaded, it forwards close to its capacity whatever the
+    offered load, so a failed trial at value v with a packet loss of L% puts
+    the capacity at about v * (1 - L / 100). The next value tested is the
+    highest value that capacity allows within the tolerated loss, minus half
+    the precision. If that trial succeeds, a value just less than the
+    precision above it is tested once to confirm it, which usually ends the
+    search.
+
+    Whenever a prediction fails or the model cannot be applied, the next value
+    is the midpoint of the interval, as with plain bisection. After a
+    confirmation step, or once MAX_PREDICTIONS values were predicted, the rest
+    of the interval is bisected, so that the search never takes more than a
+    few trials more than plain bisection.
+    """
+
+    # Maximum number of values predicted by the model in one search
+    MAX_PREDICTIONS = 2
+
+    def __init__(self, lower, upper, precision, tolerated_loss=0.0):
+        super(ModelGuided, self).__init__(lower, upper, precision, tolerated_loss)
+        self._estimate = None
+        self._confirm = False
+        self._predicted = False
+        self._confirming = False
+        self._predictions = 0
+        self._bisect = False
+
+    def estimate(self):
+        if self._estimate is not None and self.lower < self._estimate < self.upper:
+            return self._estimate
+        return None
+
+    def propose(self):
+        value = None
+        if self.trials == 0:
+            value = self.upper
+        else:
+            value = self.estimate()
+        self._confirming = value is not None and self._confirm
+        self._predicted = value is not None and self.trials > 0 and not self._confirming
+        self._estimate = None
+        self._confirm = False
+
+        if self._predicted:
+            self._predictions += 1
+        if value is None:
+            value = self.lower + (self.upper - self.lower) / 2
+        return value
+
+    def add_result(self, value, success, pkt_loss):
+        predicted = self._predicted
+        confirming = self._confirming
+        self._predicted = False
+        self._confirming = False
+        super(ModelGuided, self).add_result(value, success, pkt_loss)
+
+        if confirming or self._predictions >= self.MAX_PREDICTIONS:
+            self._bisect = True
+        if success:
+            if predicted:
+                # Confirm that the prediction is within the precision of the
+                # maximum.
+                self._estimate = value + 0.99 * self.precision
+                self._confirm = True
+        elif not predicted and not self._bisect and pkt_loss > self.tolerated_loss:
+            capacity = value * (1 - pkt_loss / 100.0)
+            self._estimate = capacity / (1 - self.tolerated_loss / 100.0) - self.precision / 2
+            logging.verbose("Estimated maximum: %s", self._estimate)
+
+
+class StepDown(SearchStrategy):
+    """Search down from a value that is expected to succeed.
+
+    The start value is tested first. While trials fail, the next value is
+    further below the last one, by the precision and then twice as much each
+    time. After the first success, the rest of the interval is bisected.
+    """
+
+    def __init__(self, lower, upper, precision, tolerated_loss=0.0, start=None):
+        """Initialize the search.
+
+        Args:
+            start (float): The first value to test. The upper bound by
+                default.
+            The other arguments are the same as for SearchStrategy.
+        """
+        super(StepDown, self).__init__(lower, upper, precision, tolerated_loss)
+        self._next = upper if start is None else start
+        self._step = precision
+
+    def propose(self):
+        if self._next is not None and self.lower < self._next <= self.upper:
+            return self._next
+        return self.lower + (self.upper - self.lower) / 2
+
+    def add_result(self, value, success, pkt_loss):
+        super(StepDown, self).add_result(value, success, pkt_loss)
+        if success:
+            self._next = None
+        elif self._next is not None and value <= self._next:
+            self._next = value - self._step
+            self._step *= 2
+
+
+class WarmStart(SearchStrategy):
+    """Search that starts by verifying a predicted interval.
+
+    The upper end of the predicted interval is tested first, then the lower
+    end. When the upper end succeeds or the lower end fails, the prediction
+    was wrong and the interval is moved past the tested value, with twice its
+    width. Once the lower end is known to succeed and the upper end to fail,
+    the wrapped strategy searches the rest of the interval. It is told about
+    all trials, including the bracketing ones. The lower end is not tested
+    when the wrapped strategy has its own estimate after the upper end
+    failed.
+    """
+
+    def __init__(self, strategy, hint_lower, hint_upper):
+        """Initialize the search.
+
+        Args:
+            strategy (SearchStrategy): The search to run once the interval is
+                verified. Its bounds are the bounds of the whole search.
+            hint_lower (float): The predicted highest successful value.
+            hint_upper (float): The predicted lowest failing value.
+        """
+        super(WarmStart, self).__init__(strategy.lower, strategy.upper,
+                strategy.precision, strategy.tolerated_loss)
+        self._strategy = strategy
+        self._hint_upper = min(hint_upper, self.upper)
+        self._hint_lower = max(hint_lower, self.lower)
+        self._upper_tested = False
+
+    def propose(self):
+        if self.upper > self._hint_upper or not self._upper_tested:
+            return self._hint_upper
+        if self.lower < self._hint_lower and self._strategy.estimate() is None:
+            return self._hint_lower
+        return self._strategy.next_value()
+
+    def add_result(self, value, success, pkt_loss):
+        super(WarmStart, self).add_result(value, success, pkt_loss)
+        self._strategy.add_result(value, success, pkt_loss)
+        if not success:
+            self._upper_tested = True
+
+        width = self._hint_upper - self._hint_lower
+        if success and value >= self._hint_upper:
+            self._hint_lower = value
+            self._hint_upper = min(self.upper, value + 2 * width)
+            self._upper_tested = False
+            logging.verbose("Predicted interval too low, moving it to [%s, %s]", self._hint_lower, self._hint_upper)
+        elif not success and value <= self._hint_lower:
+            self._hint_upper = value
+            self._hint_lower = max(self.lower, value - 2 * width)
+            logging.verbose("Predicted interval too high, moving it to [%s, %s]", self._hint_lower, self._hint_upper)
+
+
+def predict_interval(value, pkt_size, new_pkt_size, lower, upper, precision):
+    """Predict the search interval for a packet size from another one.
+
+    The prediction assumes that the SUT forwards the same number of packets
+    per second at both packet sizes. The predicted interval is 5% of the
+    predicted value wide, but not less than twice the precision.
+
+    Args:
+        value (float): The result for pkt_size, in % of line rate.
+        pkt_size (int): The packet size value was measured with.
+        new_pkt_size (int): The packet size to predict the interval for.
+        lower (float): The lower bound of the search for new_pkt_size.
+        upper (float): The upper bound of the search for new_pkt_size.
+        precision (float): The precision of the search.
+
+    Returns:
+        (float, float). The predicted interval, within [lower, upper].
+    """
+    predicted = value * utils.line_rate_to_pps(pkt_size, 1) / utils.line_rate_to_pps(new_pkt_size, 1)
+    width = max(2 * precision, 0.05 * predicted)
+    hint_upper = min(upper, predicted + width / 2)
+    hint_lower = max(lower, min(predicted - width / 2, hint_upper - width))
+    return hint_lower, hint_upper
+
+
+# Strategies that can be selected with the 'search' option in the config file
+strategies = {
+    'bisect': Bisection,
+    'model': ModelGuided,
+}
+
+
+def create(lower, upper, precision, hint=None, tolerated_loss=None):
+    """Create the search strategy selected in the config file.
+
+    Args:
+        lower (float): The lower bound of the interval.
+        upper (float): The upper bound of the interval.
+        precision (float): The precision of the search.
+        hint ((float, float)): The predicted interval, see
+            predict_interval(). The search starts by verifying it.
+        tolerated_loss (float): The packet loss in % that is tolerated.
+            Defaults to tolerated_loss from the config file.
+
+    Returns:
+        SearchStrategy. A new search over [lower, upper].
+    """
+    name = config.getOption('searchStrategy')
+    if name not in strategies:
+        raise Exception("Unknown search strategy '" + name + "', valid values are: " + ", ".join(sorted(strategies)))
+    if tolerated_loss is None:
+        tolerated_loss = float(config.getOption('toleratedLoss'))
+    strategy = strategies[name](lower, upper, precision, tolerated_loss)
+    if hint is not None:
+        logging.verbose("Predicted interval: [%s, %s]", hint[0], hint[1])
+        strategy = WarmStart(strategy, hint[0], hint[1])
+    return strategy
+
+
+def run(strategy, trial):
+    """Run trials until the search is done.
+
+    Args:
+        strategy (SearchStrategy): The search to run.
+        trial (callable): Runs a trial with the value passed as argument.
+            Returns a dict with at least the keys 'value', 'success' and
+            'pkt_loss'.
+
+    Returns:
+        ({...}, [{...}]). The successful trial with the highest value, or None
+        if no trial succeeded, and the list of all trials.
+    """
+    best, trials = run_all([strategy], trial, lambda result, tolerated_loss: result['success'])
+    return best[strategy.tolerated_loss], trials
+
+
+def run_all(strategies, trial, succeeds):
+    """Run the searches for several tolerated packet losses with shared trials.
+
+    The searches take turns to propose a value, from the lowest tolerated
+    loss up, and the outcome of every trial is passed to all of them. A
+    failed trial of one search often brackets another one, and the packet
+    loss of a trial that failed a low tolerance tells the searches with higher
+    tolerances where to look.
+
+    Args:
+        strategies ([SearchStrategy]): The searches, each with its own
+            tolerated_loss.
+        trial (callable): Runs a trial with the value passed as argument.
+            Returns a dict with at least the keys 'value' and 'pkt_loss'.
+        succeeds (callable): Returns whether the trial passed as first
+            argument succeeds with the tolerated loss passed as second
+            argument.
+
+    Returns:
+        ({float: {...}}, [{...}]). The successful trial with the highest value
+        per tolerated loss (None if no trial succeeded), and the list of all
+        trials.
+    """
+    strategies = sorted(strategies, key=lambda strategy: strategy.tolerated_loss)
+    best = dict((strategy.tolerated_loss, None) for strategy in strategies)
+    trials = []
+    while True:
+        pending = [strategy for strategy in strategies if not strategy.done()]
+        if not pending:
+            break
+        strategy = pending[0]
+        value = strategy.next_value()
+        logging.verbose("New interval [%s, %s), precision: %s",
+                strategy.lower, strategy.upper, strategy.upper - strategy.lower)
+        logging.info("Testing with value %s", value)
+
+        result = trial(value)
+        trials.append(result)
+        if succeeds(result, strategy.tolerated_loss):
+            logging.verbose("Success! Increasing lower bound")
+        else:
+            logging.verbose("Failure... Decreasing upper bound")
+        for strategy in strategies:
+            success = succeeds(result, strategy.tolerated_loss)
+            strategy.add_result(value, success, result['pkt_loss'])
+            tolerated_loss = strategy.tolerated_loss
+            if success and (best[tolerated_loss] is None or value > best[tolerated_loss]['value']):
+                best[tolerated_loss] = result
+
+    return best, trials
+
+
+def repeat(trial, best, max_runs, ci_width, confidence=95, neighbours=()):
+    """Repeat the trial of the search result to measure how stable it is.
+
+    The value of best is tested again until max_runs trials have run, or the
+    confidence interval of their throughput is narrower than ci_width percent
+    of the mean. The neighbouring values are then tested as many times, to see
+    how reliably they pass and fail.
+
+    Args:
+        trial (callable): Runs a trial with the value and the number of the
+            repetition (from 1) passed as arguments. Returns a dict with at
+            least the keys 'value', 'success' and 'throughput'.
+        best ({...}): The trial of the search result.
+        max_runs (int): Maximum number of trials of the value, including best.
+        ci_width (float): Width of the confidence interval, in percent of
+            the mean, below which no more trials are run.
+        confidence (int): Confidence level of the interval in percent.
+        neighbours ([float]): Other values to test.
+
+    Returns:
+        ({...}, [{...}]). The statistics of the throughput of the value (see
+        utils.sample_stats()) with the additional key pass_rate, and
+        'neighbours', the list of {value, pass_rate} of the neighbouring
+        values; and the list of the trials run.
+    """
+    runs = [best]
+    while len(runs) < max_runs:
+        stats = utils.sample_stats([run['throughput'] for run in runs], confidence)
+        if len(runs) > 1 and stats['ci_high'] - stats['ci_low'] <= ci_width / 100.0 * stats['mean']:
+            break
+        logging.info("Repeating value %s (run %d of at most %d)", best['value'], len(runs) + 1, max_runs)
+        runs.append(trial(best['value'], len(runs)))
+
+    def pass_rate(trials):
+        return float(sum(1 for t in trials if t['success'])) / len(trials)
+
+    trials = runs[1:]
+    stats = utils.sample_stats([run['throughput'] for run in runs], confidence)
+    stats['pass_rate'] = pass_rate(runs)
+    stats['neighbours'] = []
+    for value in neighbours:
+        logging.info("Repeating neighbouring value %s %d times", value, len(runs))
+        neighbour_runs = [trial(value, i + 1) for i in range(len(runs))]
+        trials += neighbour_runs
+        stats['neighbours'].append(dict(value=value, pass_rate=pass_rate(neighbour_runs)))
+    logging.verbose("Throughput of value %s over %d runs: mean %s, stddev %s, confidence interval [%s, %s]",
+            best['value'], stats['n'], stats['mean'], stats['stddev'], stats['ci_low'], stats['ci_high'])
+
+    return stats, trials
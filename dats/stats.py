@@ -0,0 +1,223 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Snapshots of PROX counters.
+
+A StatsSnapshot holds the counters PROX reported at one moment together with
+the TSC and its frequency. Subtracting two snapshots gives a StatsDelta, from
+which the rates and the packet loss over the window between both follow.
+"""
+
+# PROX counters are 64 bit and wrap around to 0.
+COUNTER_WRAP = 2 ** 64
+
+# Bytes added on the wire to every packet: preamble, SFD and inter-frame gap.
+WIRE_OVERHEAD = 20
+
+
+class Counters(object):
+    """Packet counters of one or more ports, cores or tasks.
+
+    Base class of StatsSnapshot and StatsDelta. Counters that are not
+    reported by the PROX command they were read from are 0.
+    """
+    COUNTERS = ('rx', 'tx', 'drop', 'no_mbufs', 'ierrors')
+    __slots__ = COUNTERS + ('tsc', 'hz')
+
+    def __init__(self, rx=0, tx=0, drop=0, no_mbufs=0, ierrors=0, tsc=0, hz=0):
+        self.rx = rx
+        self.tx = tx
+        self.drop = drop
+        self.no_mbufs = no_mbufs
+        self.ierrors = ierrors
+        self.tsc = tsc
+        self.hz = hz
+
+    def lost(self):
+        """Return the number of packets sent but not received."""
+        return self.tx - self.rx
+
+    def loss(self):
+        """Return the lost packets as a percentage of the packets sent."""
+        if self.tx <= 0:
+            return 0.0
+        return 100.0 * self.lost() / self.tx
+
+    def __add__(self, other):
+        """Sum the counters, e.g. of several ports.
+
+        The tsc of the sum is the latest of both.
+        """
+        kwargs = dict((name, getattr(self, name) + getattr(other, name))
+                for name in self.COUNTERS)
+        return type(self)(tsc=max(self.tsc, other.tsc), hz=self.hz or other.hz, **kwargs)
+
+    def __radd__(self, other):
+        # Lets sum() start from 0.
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+                "{}={}".format(name, getattr(self, name)) for name in Counters.__slots__))
+
+
+class StatsSnapshot(Counters):
+    """Counter values read from PROX at one moment, stamped with its TSC.
+
+    Subtracting an earlier snapshot gives the StatsDelta over the window
+    between both.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_tot_stats(cls, reply):
+        """Parse the reply to 'tot stats': rx,tx,tsc,hz."""
+        rx, tx, tsc, hz = map(int, reply.split(",")[:4])
+        return cls(rx=rx, tx=tx, tsc=tsc, hz=hz)
+
+    @classmethod
+    def from_core_stats(cls, reply, hz=0):
+        """Parse the reply to 'core stats <core> <task>': rx,tx,drop,tsc."""
+        rx, tx, drop, tsc = map(int, reply.split(",")[:4])
+        return cls(rx=rx, tx=tx, drop=drop, tsc=tsc, hz=hz)
+
+    @classmethod
+    def from_port_stats(cls, reply):
+        """Parse the reply to 'port_stats <port>'.
+
+        Only the totals are kept, the rates computed by PROX are dropped.
+        """
+        values = map(int, reply.split(","))
+        return cls(rx=values[6], tx=values[7], no_mbufs=values[8],
+                ierrors=values[9], tsc=values[10], hz=values[11])
+
+    def __sub__(self, earlier):
+        """Return the StatsDelta from the earlier snapshot to this one."""
+        kwargs = dict((name, (getattr(self, name) - getattr(earlier, name)) % COUNTER_WRAP)
+                for name in self.COUNTERS)
+        return StatsDelta(tsc=(self.tsc - earlier.tsc) % COUNTER_WRAP,
+                hz=self.hz or earlier.hz, **kwargs)
+
+
+class StatsDelta(Counters):
+    """Change of the counters over a window between two StatsSnapshots.
+
+    tsc is the length of the window in TSC cycles.
+    """
+    __slots__ = ()
+
+    def seconds(self):
+        """Return the length of the window in seconds."""
+        if not self.hz:
+            return 0.0
+        return self.tsc / float(self.hz)
+
+    def _per_second(self, count):
+        seconds = self.seconds()
+        if seconds <= 0:
+            return 0.0
+        return count / seconds
+
+    def rx_pps(self):
+        """Return the receive rate in packets per second."""
+        return self._per_second(self.rx)
+
+    def tx_pps(self):
+        """Return the transmit rate in packets per second."""
+        return self._per_second(self.tx)
+
+    def drop_pps(self):
+        """Return the drop rate in packets per second."""
+        return self._per_second(self.drop)
+
+    def rx_bps(self, pkt_size):
+        """Return the receive rate in bits per second on the wire."""
+        return self.rx_pps() * (pkt_size + WIRE_OVERHEAD) * 8
+
+    def tx_bps(self, pkt_size):
+        """Return the transmit rate in bits per second on the wire."""
+        return self.tx_pps() * (pkt_size + WIRE_OVERHEAD) * 8
+
+
+class StatsBatch(object):
+    """Counters of the ports and cores of a trial, read in a single batch.
+
+    The counters are all read in one round trip to PROX, so they are sampled
+    within microseconds of each other, and the tsc of the total statistics
+    stamps the batch. Subtracting an earlier batch subtracts the counters
+    one by one, giving a batch of StatsDeltas over exactly the same window.
+
+    Attributes:
+        tot (Counters): The total statistics of the PROX instance.
+        ports ({int: Counters}): The counters of each port.
+        cores ({int: Counters}): The counters of each core.
+        tasks ({(int, int): Counters}): The counters of each task, by core
+            and task.
+        sut (StatsBatch): The counters of the SUT, read right after these,
+            or None.
+    """
+    __slots__ = ('tot', 'ports', 'cores', 'tasks', 'sut')
+
+    def __init__(self, tot, ports=None, cores=None, tasks=None, sut=None):
+        self.tot = tot
+        self.ports = ports or {}
+        self.cores = cores or {}
+        self.tasks = tasks or {}
+        self.sut = sut
+
+    @property
+    def tsc(self):
+        """The TSC at which the batch was read."""
+        return self.tot.tsc
+
+    def port_total(self):
+        """Return the counters summed over all ports."""
+        return sum(self.ports.values(), type(self.tot)(hz=self.tot.hz))
+
+    def core_total(self):
+        """Return the counters summed over all cores."""
+        return sum(self.cores.values(), type(self.tot)(hz=self.tot.hz))
+
+    def __sub__(self, earlier):
+        """Return the batch of StatsDeltas from the earlier batch to this one."""
+        sut = None
+        if self.sut is not None and earlier.sut is not None:
+            sut = self.sut - earlier.sut
+        return StatsBatch(self.tot - earlier.tot,
+                dict((port, stats - earlier.ports[port]) for port, stats in self.ports.items()),
+                dict((core, stats - earlier.cores[core]) for core, stats in self.cores.items()),
+                dict((task, stats - earlier.tasks[task]) for task, stats in self.tasks.items()),
+                sut)
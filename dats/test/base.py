@@ -60,10 +60,22 @@ The test run looks like:
 
 import abc
 import sys
+import time
 import logging
+import threading
+import Queue
+import os
+import os.path as path
+import hashlib
 
 from dats.remote_control import remote_system
+from dats.prox import prox
+from dats.sampler import StatsSampler
+import dats.emulator as emulator
+import dats.trialstore as trialstore
 import dats.config as config
+import dats.plot
+import dats.rstgen as rst
 
 
 class TestBase(object):
@@ -132,6 +144,9 @@ class TestBase(object):
         self._kpi = None
         self._remotes = {}
         self._n_ports = 4
+        self._trial_aborted = None
+        self._trial_window = None
+        self._run_context = None
 
         return
 
@@ -170,7 +185,15 @@ class TestBase(object):
         if remote_name in self._remotes:
             return self._remotes[remote_name]
 
-        if remote_name == "sut":
+        if config.getArg('emulate'):
+            if remote_name not in ("sut", "tester"):
+                raise NameError("The remote with name '" + remote_name + "' is not defined in the config file")
+            self._remotes[remote_name] = emulator.EmulatedSystem(remote_name,
+                    emulator.get_model(), config.getOption(remote_name + 'User'),
+                    config.getOption(remote_name + 'Ip'), config.getOption(remote_name + 'DpdkDir'),
+                    config.getOption(remote_name + 'DpdkTgt'),
+                    config.getOption(remote_name + 'ProxDir'))
+        elif remote_name == "sut":
             self._remotes[remote_name] = remote_system(config.getOption('sutUser'),
                     config.getOption('sutIp'), config.getOption('sutDpdkDir'),
                     config.getOption('sutDpdkTgt'),
@@ -185,6 +208,496 @@ class TestBase(object):
 
         return self._remotes[remote_name]
 
+    def start_prox(self, tester_config, tester_args, sut_config, sut_args):
+        """Start PROX on the Tester and on the SUT in parallel.
+
+        Both instances are started with run_prox_with_config(). Any extra
+        config files must have been copied to the remotes beforehand.
+
+        Args:
+            tester_config (str): PROX config file for the Tester.
+            tester_args (str): Extra PROX arguments for the Tester.
+            sut_config (str): PROX config file for the SUT.
+            sut_args (str): Extra PROX arguments for the SUT.
+
+        Returns:
+            (prox, prox). The connections to the Tester and to the SUT.
+
+        Raises:
+            The exception raised by the first system on which PROX fails to
+            start. Startup on the other system is aborted.
+        """
+        remotes = dict(tester=self.get_remote('tester'), sut=self.get_remote('sut'))
+        launches = dict(tester=(tester_config, tester_args, "Tester"),
+                sut=(sut_config, sut_args, "SUT"))
+        done = Queue.Queue()
+
+        def launch(name):
+            try:
+                done.put((name, remotes[name].run_prox_with_config(*launches[name]), None))
+            except Exception, ex:
+                done.put((name, None, ex))
+
+        for name in remotes:
+            remotes[name].abort_prox(None)
+            thread = threading.Thread(target=launch, args=(name,))
+            thread.daemon = True
+            thread.start()
+
+        connections = {}
+        while len(connections) < len(remotes):
+            # Wait with a timeout, so that the wait can be interrupted
+            try:
+                name, connection, ex = done.get(True, 1)
+            except Queue.Empty:
+                continue
+            if ex is not None:
+                for other in remotes:
+                    if other != name:
+                        remotes[other].abort_prox("PROX startup aborted, it failed on the " + launches[name][2])
+                raise ex
+            connections[name] = connection
+
+        return connections['tester'], connections['sut']
+
+    # Packets that may still be in flight through the SUT, in seconds of
+    # traffic at the current rate, when the test measures no latency. They
+    # are not counted as lost when deciding whether to end a trial early.
+    IN_FLIGHT_TIME = 0.005
+
+    # Variation in the number of packets in flight through the SUT, in
+    # seconds of traffic at the trial rate. The packets in flight at the
+    # start and at the end of a measurement window differ by at most this
+    # many, so the loss counted over the window may be off by as much.
+    IN_FLIGHT_JITTER = 0.0001
+
+    # Interval in seconds at which the counters are checked during a trial
+    TRIAL_POLL_INTERVAL = 0.5
+
+    def early_abort(self):
+        """Return whether wait_trial() may end failing trials early.
+
+        Disabled by default. Tests that only need to know whether a trial
+        succeeds enable it with the early_abort option in the config file.
+        """
+        return False
+
+    def tolerated_losses(self):
+        """Return the packet losses in % the searches find a result for.
+
+        Returns:
+            [float]. tolerated_loss and the pdr_losses from the config file,
+            sorted and without duplicates.
+        """
+        losses = [float(config.getOption('toleratedLoss'))]
+        if config.getOption('pdrLosses'):
+            losses += map(float, config.getOption('pdrLosses').split(','))
+        return sorted(set(losses))
+
+    def in_flight(self, window):
+        """Return by how many packets the loss over a window may be off.
+
+        Args:
+            window (StatsBatch): The counters over the measurement window.
+
+        Returns:
+            int. Packets sent in the window that may be counted as lost
+            without being lost.
+        """
+        return int(window.tot.tx_pps() * self.IN_FLIGHT_JITTER) + 1
+
+    def latency_cores(self):
+        """Return the Tester cores that measure the latency through the SUT.
+
+        Returns:
+            [int]. The cores, none by default.
+        """
+        return []
+
+    def trial_latency(self):
+        """Return the highest latency the Tester measured so far, in seconds.
+
+        Returns:
+            float. The highest maximum latency of the cores from
+            latency_cores(), or None if the test has no latency cores.
+        """
+        cores = self.latency_cores()
+        if not cores:
+            return None
+        _, lat_max, _ = self._tester.lat_stats(cores)
+        return max(lat_max[core] for core in cores) / 1000000000.0
+
+    def wait_trial(self, duration, start=None, ports=(), cores=()):
+        """Wait while the Tester generates traffic for a trial.
+
+        When early_abort() is enabled, the counters of the Tester ports (or
+        cores, if no ports are given) are read every TRIAL_POLL_INTERVAL
+        seconds and compared with the start batch. The wait ends early when
+        the packets lost since the start exceed the highest tolerated loss
+        (see tolerated_losses()) of all the packets the trial can still send,
+        or when the loss exceeds it by more than the abort_margin from the
+        config file. The packets that may still be in flight through the SUT
+        are not counted as lost: as many as the Tester sends during the
+        highest latency measured so far, see trial_latency(), or during
+        IN_FLIGHT_TIME if the test measures no latency. The caller then
+        collects the counters as usual, which yields a failure with the
+        partial measurement.
+
+        Args:
+            duration (float): The duration of the trial in seconds.
+            start (StatsBatch): The Tester counters read at the start of the
+                trial, see snapshot(). The trial is never ended early
+                without it.
+            ports ([int]): Tester ports the start batch has the counters of.
+            cores ([int]): Tester cores the start batch has the counters of.
+
+        Returns:
+            float. The time actually waited, in seconds.
+        """
+        self._trial_aborted = None
+        self._trial_window = None
+        tester = getattr(self, '_tester', None)
+        if not self.early_abort() or tester is None or start is None:
+            time.sleep(duration)
+            return duration
+
+        tolerated = max(self.tolerated_losses()) / 100.0
+        margin = float(config.getOption('abortMargin')) / 100.0
+
+        begin = time.time()
+        end = begin + duration
+        while True:
+            now = time.time()
+            if now >= end:
+                return now - begin
+            time.sleep(min(self.TRIAL_POLL_INTERVAL, end - now))
+
+            window = tester.snapshot(ports, cores) - start
+            if ports:
+                counters = window.port_total()
+            elif cores:
+                counters = window.core_total()
+            else:
+                counters = window.tot
+            latency = self.trial_latency()
+            now = time.time()
+            if counters.tx > 0 and window.tot.seconds() > 0:
+                rate = counters.tx / window.tot.seconds()
+                in_flight = rate * (self.IN_FLIGHT_TIME if latency is None else latency)
+                lost = counters.lost() - in_flight
+                max_tx = counters.tx + rate * max(0.0, end - now)
+                if lost > tolerated * max_tx or lost > (tolerated + margin) * counters.tx:
+                    self._trial_aborted = now - begin
+                    logging.verbose("Ending trial after %.1f s of %.1f s, packet loss %.3f%%",
+                            now - begin, duration, counters.loss())
+                    return now - begin
+
+    def sut_cores(self):
+        """Return the SUT cores whose drop counters are read for each trial.
+
+        Tests override this with the cores their SUT config runs tasks on.
+
+        Returns:
+            [int]. The cores, task 0 of each is read.
+        """
+        return []
+
+    def sut_tasks(self):
+        """Return the SUT tasks to profile, see profile_tasks().
+
+        Tests whose SUT cores run more than one task override this. The
+        tasks are listed in the order the packets pass through them, which
+        decides between tasks that are equally busy, see
+        SearchBase.task_profile().
+
+        Returns:
+            [(int, int)]. The tasks as (core, task) pairs, task 0 of every
+            core from sut_cores() by default.
+        """
+        return [(core, 0) for core in self.sut_cores()]
+
+    def profile_tasks(self):
+        """Return whether the counters of every SUT task are read for each trial.
+
+        Disabled by default. Tests that report a task profile enable it with
+        the profile_tasks option in the config file.
+        """
+        return False
+
+    def snapshot(self, ports=(), cores=()):
+        """Read the Tester counters of a trial, and the SUT counters with them.
+
+        The SUT counters are read in a single batch right after the Tester
+        counters: the SUT ports, the SUT cores from sut_cores() and the total
+        ierrors. They are used to attribute the drops of the trial, see
+        trial_drops(). When profiling, the tasks from sut_tasks() are read
+        too, see trial_profile().
+
+        Args:
+            ports ([int]): Tester ports to read the counters of.
+            cores ([int]): Tester cores to read the counters of.
+
+        Returns:
+            StatsBatch. The Tester counters, with the SUT counters as its sut
+            attribute if the test has a PROX connection to the SUT.
+        """
+        batch = self._tester.snapshot(ports, cores)
+        sut = getattr(self, '_sut', None)
+        if isinstance(sut, prox):
+            tasks = self.sut_tasks() if self.profile_tasks() else ()
+            batch.sut = sut.snapshot(range(self._n_ports), self.sut_cores(), ierrors=True, tasks=tasks)
+        return batch
+
+    def measure_trial(self, duration, ports=(), cores=()):
+        """Wait for a trial and return the change of the counters over it.
+
+        The counters are read with snapshot() right before and after
+        wait_trial(), before the cores are stopped: stopping cores takes some
+        time and would skew the results otherwise.
+
+        Args:
+            duration (float): The duration of the trial in seconds.
+            ports ([int]): Tester ports to read the counters of.
+            cores ([int]): Tester cores to read the counters of.
+
+        Returns:
+            StatsBatch. The deltas of the counters over the trial.
+        """
+        start = self.snapshot(ports, cores)
+        self.wait_trial(duration, start, ports, cores)
+        self._trial_window = self.snapshot(ports, cores) - start
+        return self._trial_window
+
+    def trial_drops(self):
+        """Break the packets lost in the last trial down by where they were dropped.
+
+        The packets sent by the Tester but not received back are compared
+        with the drops the SUT counted over the trial: those of the NICs,
+        because the receive queues were full or the packets were errored,
+        those for lack of mbufs, and those of each SUT core.
+
+        The SUT counters are read in a separate round trip right after the
+        Tester counters, see snapshot(), so the SUT window is shifted from the
+        Tester window by the time that round trip takes. The SUT may count
+        drops in that time that the Tester window does not cover, or the other
+        way around. The breakdown is therefore an estimate: the unaccounted
+        packets are clamped at 0 when the SUT counted more drops than the
+        Tester lost.
+
+        Returns:
+            {...}. With keys:
+                lost (int): Packets lost according to the Tester ports, or
+                    the Tester cores if no ports were read.
+                nic (int): Packets the SUT NICs dropped on receive.
+                no_mbufs (int): Packets dropped for lack of mbufs.
+                cores ({int: int}): Packets each SUT core dropped.
+                unaccounted (int): Lost packets the SUT did not count, at
+                    least 0.
+            None if the SUT counters of the last trial were not read.
+        """
+        window = self._trial_window
+        if window is None or window.sut is None:
+            return None
+        tester = window.port_total() if window.ports else window.core_total()
+        sut = window.sut
+        cores = dict((core, stats.drop) for core, stats in sut.cores.items())
+        no_mbufs = sut.port_total().no_mbufs
+        return dict(
+            lost=tester.lost(),
+            nic=sut.tot.ierrors,
+            no_mbufs=no_mbufs,
+            cores=cores,
+            unaccounted=max(0, tester.lost() - sut.tot.ierrors - no_mbufs - sum(cores.values())),
+        )
+
+    def trial_profile(self):
+        """Return the rates of every SUT task over the last trial.
+
+        Returns:
+            {(int, int): {...}}. For each (core, task) from sut_tasks(), the
+            rates in Mpps over the trial window, with keys 'rx', 'tx' and
+            'drop'. None if the tasks were not profiled.
+        """
+        window = self._trial_window
+        if window is None or window.sut is None or not window.sut.tasks:
+            return None
+        return dict((task, dict(rx=stats.rx_pps() / 1000000,
+                                tx=stats.tx_pps() / 1000000,
+                                drop=stats.drop_pps() / 1000000))
+                    for task, stats in window.sut.tasks.items())
+
+    def run_context(self):
+        """Return what the results of the test depend on.
+
+        Besides the parameters of a trial, its outcome depends on the test,
+        the test script and PROX config files, the Tester and SUT hardware,
+        and a few options from the config file.
+
+        Returns:
+            {...}. A JSON-serializable description of the context.
+        """
+        if self._run_context is None:
+            files = hashlib.md5()
+            configs_dir = path.join(config.getArg('tests_dir'), 'prox-configs')
+            sources = [sys.modules[self.__module__].__file__] + \
+                    [path.join(configs_dir, name) for name in sorted(os.listdir(configs_dir))]
+            for filename in sources:
+                if path.isfile(filename):
+                    with open(filename, 'rb') as f:
+                        files.update(f.read())
+
+            self._run_context = dict(
+                test=self.__module__ + '.' + self.__class__.__name__,
+                files=files.hexdigest(),
+                tester=self.get_remote('tester').host_fingerprint(),
+                sut=self.get_remote('sut').host_fingerprint(),
+                options=[config.getOption(option) for option in self.CONTEXT_OPTIONS],
+            )
+        return self._run_context
+
+    # Options from the config file that influence the outcome of a trial, or
+    # what is recorded of it
+    CONTEXT_OPTIONS = ('toleratedLoss', 'pdrLosses', 'settleMode', 'earlyAbort', 'abortMargin',
+            'maxLatency', 'latencyStat', 'profileTasks', 'testerSocketId', 'sutSocketId',
+            'emuCapacity', 'emuLatency')
+
+    def stored(self, kind, params, run):
+        """Return the result of run(), going through the trial store.
+
+        The result is stored under the run context, kind and params. When
+        DATS runs with --resume and a result is stored already, it is
+        returned instead of calling run().
+
+        Args:
+            kind (str): What is stored, e.g. 'trial'.
+            params ({...}): JSON-serializable parameters of run().
+            run (callable): Returns the result to store.
+
+        Returns:
+            The result.
+        """
+        store = trialstore.get_store()
+        key = trialstore.make_key(kind, self.run_context(), params)
+        if config.getArg('resume'):
+            result = store.get(key)
+            if result is not None:
+                logging.verbose("Reusing stored %s %s", kind, params)
+                return result
+
+        result = run()
+        store.put(key, result)
+        return result
+
+    def start_sampler(self):
+        """Start sampling the Tester counters in the background.
+
+        The Tester is the PROX instance stored in self._tester by
+        setup_class(). Its first self._n_ports ports are sampled.
+
+        Returns:
+            StatsSampler. The running sampler, or None if sampling is disabled
+            or the test has no Tester connection.
+        """
+        interval = float(config.getOption('sampleInterval'))
+        tester = getattr(self, '_tester', None)
+        if interval <= 0 or tester is None:
+            return None
+
+        sampler = StatsSampler(tester, range(self._n_ports), interval)
+        sampler.start()
+        return sampler
+
+    def stop_sampler(self, sampler):
+        """Stop a sampler returned by start_sampler().
+
+        Returns:
+            [(t, tx_mpps, rx_mpps, loss)]. The rate time series of the trial,
+            see StatsSampler.rate_series(). Empty if sampling was disabled.
+        """
+        if sampler is None:
+            return []
+        sampler.stop()
+        return sampler.rate_series()
+
+    def generate_drops_report(self, trials):
+        """Generate a table of where the packets of each trial were dropped.
+
+        Args:
+            trials ([{...}]): Trials with the keys 'value' and 'drops', see
+                trial_drops(), and optionally 'phase'.
+
+        Returns:
+            str. reStructuredText with the table, or an empty string if the
+            drops of no trial were attributed.
+        """
+        trials = [trial for trial in trials if trial.get('drops')]
+        if not trials:
+            return ''
+
+        table = [['Phase', 'Value (%)', 'Lost', 'NIC drops', 'No mbufs', 'Core drops', 'Top core', 'Unaccounted']]
+        for trial in trials:
+            drops = trial['drops']
+            cores = drops['cores']
+            top_core = ''
+            if cores and max(cores.values()) > 0:
+                top_core = "{} ({})".format(*max(cores.items(), key=lambda item: item[1]))
+            table.append([
+                trial.get('phase', ''),
+                "{:.2f}".format(trial['value']),
+                drops['lost'],
+                drops['nic'],
+                drops['no_mbufs'],
+                sum(cores.values()),
+                top_core,
+                drops['unaccounted'],
+            ])
+
+        report = '\n'
+        report += rst.section('Drop attribution', '~')
+        report += rst.simple_table(table)
+        report += '\n'
+        report += "The SUT counters are read right after the Tester counters, so the SUT drops are " \
+                "estimates over a slightly shifted window. Unaccounted is at least 0.\n\n"
+        return report
+
+    def generate_series_report(self, trials, prefix, dir, name):
+        """Generate plots of throughput and packet loss over time.
+
+        Args:
+            trials ([{...}]): Trials with keys 'value' (the value tested) and
+                'series' (as returned by stop_sampler()).
+            prefix (str): Prefix for the image file names.
+            dir (str): Directory where the images are written.
+            name (str): Unique suffix for the image file names.
+
+        Returns:
+            str. reStructuredText including both plots, or an empty string if
+            no samples were taken.
+        """
+        trials = [trial for trial in trials if trial.get('series')]
+        if not trials:
+            return ''
+
+        throughput = [('{:g}%'.format(trial['value']), [(s[0], s[2]) for s in trial['series']]) for trial in trials]
+        loss = [('{:g}%'.format(trial['value']), [(s[0], s[3]) for s in trial['series']]) for trial in trials]
+        dats.plot.line_plot(throughput, 'Time (s)', 'Throughput (Mpps)', dir + prefix + 'rate_{}.png'.format(name))
+        dats.plot.line_plot(loss, 'Time (s)', 'Packet loss (%)', dir + prefix + 'loss_{}.png'.format(name))
+
+        report = ''
+        report += '.. image:: ' + prefix + 'rate_{}.png\n'.format(name)
+        report += '\n'
+        report += '.. image:: ' + prefix + 'loss_{}.png\n'.format(name)
+        report += '\n'
+        return report
+
+    def prox_time_saved(self):
+        """Return the time saved by confirming PROX command completion.
+
+        Returns:
+            float. The number of seconds saved, compared to waiting a fixed
+            delay after each command, on all remotes used by the test.
+        """
+        return sum(remote.prox_time_saved() for remote in self._remotes.values())
 
     def kpi(self):
         """Return the Key Performance Indicator (KPI) for the test.
@@ -37,21 +37,18 @@ The interface for the tests that perform a binary search.
 This abstract base class defines the common properties and methods for tests
 that perform a binary search.
 
-The binary search algorithm is also implemented here.
+The search itself is run by dats.test.searchbase.SearchBase.
 """
 
 import abc
-import time
-import logging
 
-import dats.test.base
-import dats.config as config
+import dats.test.searchbase
 import dats.plot
 import dats.utils as utils
 import dats.rstgen as rst
 
 
-class BinarySearch(dats.test.base.TestBase):
+class BinarySearch(dats.test.searchbase.SearchBase):
     __metaclass__ = abc.ABCMeta
 
     def __init__(self):
@@ -94,110 +91,24 @@ class BinarySearch(dats.test.base.TestBase):
         """
         return 64
 
-    def run_all_tests(self):
-        """Iterate over requested packet sizes and search for the maximum value that yields success.
-
-        Returns:
-            [{...}]. An array with a dict per packet size the test has run
-            with.
-            See run_test_with_pkt_size() for a description of the dicts. The
-            following keys are added to the dicts:
-            pkt_size (int): The packet size used when measuring
-            duration (float): The duration of the search in seconds
-        """
-        results = []
-
-        pkt_sizes = map(int, config.getOption('pktSizes').split(','))
-        for pkt_size in pkt_sizes:
-            # Adjust packet size upwards if it's less than the minimum
-            # required packet size for the test.
-            if pkt_size < self.min_pkt_size():
-                pkt_size += self.min_pkt_size() - 64
-
-            # time duration of a single step
-            duration = float(config.getOption('testDuration'))
-            start_time = time.time()
-            result = self.run_test_with_pkt_size(pkt_size, duration)
-            stop_time = time.time()
-            result['pkt_size'] = pkt_size
-            result['duration'] = stop_time - start_time
-
-            results.append(result)
-
-        return results
-
-    def run_test_with_pkt_size(self, pkt_size, duration):
+    def run_test_with_pkt_size(self, pkt_size, duration, hint=None):
         """Run the test for a single packet size.
 
         Args:
             pkt_size (int): The packet size to test with.
             duration (int): The duration for each try.
+            hint ((float, float)): The predicted interval to start from, see
+                dats.search.create().
 
         Returns:
-            {lower_bound, upper_bound, measurement}.
-            lower_bound (long): The lower bound of the search interval.
-            upper_bound (long): The upper bound of the search interval.
-            measurement (long): The maximum value in the interval that yields
-            success.
+            {...}. The result of the search, see SearchBase.search_pkt_size().
         """
-        precision = float(config.getOption('testPrecision'))
-
-        lower = self.lower_bound(pkt_size)
-        upper = self.upper_bound(pkt_size)
-
-        logging.info("Testing with packet size %d", pkt_size)
-
-        # Binary search assumes the lower value of the interval is
-        # successful and the upper value is a failure.
-        # The first value that is tested, is the maximum value. If that
-        # succeeds, no more searching is needed. If it fails, a regular
-        # binary search is performed.
-        # The test_value used for the first iteration of binary search
-        # is adjusted so that the delta between this test_value and the
-        # upper bound is a power-of-2 multiple of precision. In the
-        # optimistic situation where this first test_value results in a
-        # success, the binary search will complete on an integer multiple
-        # of the precision, rather than on a fraction of it.
-        adjust = precision
-        while upper - lower > adjust:
-            adjust *= 2
-        adjust = (upper - lower - adjust) / 2
-
-        test_value = upper
-
-        # throughput and packet loss from the last successfull test
-        successfull_throughput = 0
-        successfull_pkt_loss = 0
-        while upper - lower >= precision:
-            logging.verbose("New interval [%s, %s), precision: %d",
-                lower, upper, upper - lower)
-            logging.info("Testing with value %s", test_value)
-
-            self.setup_test(pkt_size=pkt_size, speed=test_value)
-            success, throughput, pkt_loss = self.run_test(pkt_size, duration, test_value)
-            self.teardown_test(pkt_size=pkt_size)
-
-            if success:
-                logging.verbose("Success! Increasing lower bound")
-                lower = test_value
-                successfull_throughput = throughput
-                successfull_pkt_loss = pkt_loss
-            else:
-                logging.verbose("Failure... Decreasing upper bound")
-                upper = test_value
-
-            test_value = lower + (upper - lower) / 2 + adjust
-            adjust = 0
-
-        successfull_throughput = round(successfull_throughput, 2)
-        self.update_kpi(dict(pkt_size=pkt_size, measurement=successfull_throughput))
-
-        return dict(
-            lower_bound=self.lower_bound(pkt_size),
-            upper_bound=self.upper_bound(pkt_size),
-            measurement=successfull_throughput,
-            pkt_loss=successfull_pkt_loss
-        )
+        def measure(value, trial_duration):
+            success, throughput, pkt_loss = self.run_test(pkt_size, trial_duration, value)
+            return dict(success=success, throughput=throughput, pkt_loss=pkt_loss)
+
+        result, _ = self.search_pkt_size(pkt_size, duration, hint, measure)
+        return result
 
     @abc.abstractmethod
     def run_test(self, pkt_size, duration, value):
@@ -217,7 +128,7 @@ class BinarySearch(dats.test.base.TestBase):
 
     def get_cpu_id(self, cpu_map, core_id, socket_id, is_hyperthread):
         try:
-            return cpu_map[socket_id][core_id][1 if is_hyperthread else 0]
+            return cpu_map[(socket_id, core_id, 1 if is_hyperthread else 0)]
         except:
             raise Exception("Core {}{} on socket {} does not exist" \
                     .format(str(core_id), "h" if is_hyperthread else "", str(socket_id)))
@@ -252,6 +163,19 @@ class BinarySearch(dats.test.base.TestBase):
         report += '.. image:: ' + prefix + 'results.png\n'
         report += '\n'
         report += rst.simple_table(table)
+        report += self.generate_repetitions_report(results)
+        report += self.generate_tolerances_report(results)
+
+        # All trials of the search, with throughput and packet loss over time
+        for result in results:
+            trials_report = self.generate_trials_report(result.get('trials', []))
+            trials_report += self.generate_drops_report(result.get('trials', []))
+            trials_report += self.generate_profile_report(result)
+            trials_report += self.generate_series_report(result.get('trials', []), prefix, dir, result['pkt_size'])
+            if trials_report:
+                report += '\n'
+                report += rst.section('Trials with packet size {}'.format(result['pkt_size']), '-')
+                report += trials_report
 
         return report
     def generate_json(self, results):
@@ -264,20 +188,36 @@ class BinarySearch(dats.test.base.TestBase):
             result_dict['TheoreticalMax(Mpps)'] = "{:.2f}".format(round(utils.line_rate_to_pps(result['pkt_size'], 4) / 1000000, 2))
             result_dict['Duration(s)'] = "{:.1f}".format(round(result['duration'], 1))
             result_dict['PacketLoss(%)'] = round(result['pkt_loss'], 5)
+            if result.get('repetitions') is not None:
+                for (_, key), value in zip(self.REPETITION_COLUMNS, self.repetition_values(result)):
+                    result_dict[key] = value
+            if self.saturated_task_name(result) is not None:
+                result_dict['SaturatedTask'] = self.saturated_task_name(result)
             test_results["pkt_test_" + str(index)] = result_dict
             index += 1
+
+        for index, row in enumerate(self.tolerance_rows(results)):
+            test_results["pdr_test_" + str(index)] = dict(zip([key for _, key in self.TOLERANCE_COLUMNS], row))
         return test_results
 
     def generate_csv(self, results):
-        csv_string = 'Packet size (B),Throughput (Mpps),Theoretical Max (Mpps),Duration (s),Packet loss (%)\n'
+        repeated = any(result.get('repetitions') for result in results)
+        csv_string = 'Packet size (B),Throughput (Mpps),Theoretical Max (Mpps),Duration (s),Packet loss (%)'
+        if repeated:
+            csv_string += ',' + ','.join(column for column, _ in self.REPETITION_COLUMNS)
+        csv_string += '\n'
         
         # add data lines
         for result in results:
-            csv_string += "{},{:.2f},{:.2f},{:.1f},{:.5f}\n".format(result['pkt_size'],
+            csv_string += "{},{:.2f},{:.2f},{:.1f},{:.5f}".format(result['pkt_size'],
                 result['measurement'],
                 round(utils.line_rate_to_pps(result['pkt_size'], 4) / 1000000, 2),
                 round(result['duration'], 1),
                 round(result['pkt_loss'], 5))
+            if repeated:
+                csv_string += ',' + ','.join(self.repetition_values(result))
+            csv_string += '\n'
+        csv_string += self.generate_tolerances_csv(results)
 
         return csv_string
 
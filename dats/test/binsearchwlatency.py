@@ -37,21 +37,20 @@ The interface for the tests that perform a binary search.
 This abstract base class defines the common properties and methods for tests
 that perform a binary search.
 
-The binary search algorithm is also implemented here.
+The search itself is run by dats.test.searchbase.SearchBase.
 """
 
 import abc
-import time
 import logging
 
-import dats.test.base
+import dats.test.searchbase
 import dats.config as config
 import dats.plot
 import dats.utils as utils
 import dats.rstgen as rst
 
 
-class BinarySearchWithLatency(dats.test.base.TestBase):
+class BinarySearchWithLatency(dats.test.searchbase.SearchBase):
     __metaclass__ = abc.ABCMeta
 
     def __init__(self):
@@ -106,110 +105,81 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
         """
         return []
 
-    def run_all_tests(self):
-        """Iterate over requested packet sizes and search for the maximum value that yields success.
+    def latency_bounded(self):
+        """Return whether max_latency is set in the config file.
 
-        Returns:
-            [{...}]. An array with a dict per packet size the test has run
-            with.
-            See run_test_with_pkt_size() for a description of the dicts. The
-            following keys are added to the dicts:
-            pkt_size (int): The packet size used when measuring
-            duration (float): The duration of the search in seconds
+        Only then are the results limited by latency, and the report, CSV and
+        JSON say what limited them.
         """
-        results = []
-
-        pkt_sizes = map(int, config.getOption('pktSizes').split(','))
-        for pkt_size in pkt_sizes:
-            # Adjust packet size upwards if it's less than the minimum
-            # required packet size for the test.
-            if pkt_size < self.min_pkt_size():
-                pkt_size += self.min_pkt_size() - 64
-
-            # time duration of a single step
-            duration = float(config.getOption('testDuration'))
-            start_time = time.time()
-            result = self.run_test_with_pkt_size(pkt_size, duration)
-            stop_time = time.time()
-            result['pkt_size'] = pkt_size
-            result['duration'] = stop_time - start_time
+        return float(config.getOption('maxLatency')) > 0
 
-            results.append(result)
+    def latency_exceeded(self, latency):
+        """Check a trial against the latency bound from the config file.
 
-        return results
+        Args:
+            latency ({...}): The latency measured during the trial, as
+                returned by run_test().
 
-    def run_test_with_pkt_size(self, pkt_size, duration):
+        Returns:
+            bool. True if the configured latency statistic (max or avg) of a
+            core in latency_cores() is above max_latency.
+        """
+        if not self.latency_bounded():
+            return False
+        max_latency = float(config.getOption('maxLatency'))
+        stat = latency['latency_' + config.getOption('latencyStat')]
+        worst = max(stat[core] for core in self.latency_cores())
+        if worst > max_latency:
+            logging.verbose("Latency %s ns exceeds %s ns", worst, max_latency)
+            return True
+        return False
+
+    def trial_succeeds(self, trial, tolerated_loss):
+        if trial['limit'] and 'latency' in trial['limit']:
+            return False
+        return super(BinarySearchWithLatency, self).trial_succeeds(trial, tolerated_loss)
+
+    def run_test_with_pkt_size(self, pkt_size, duration, hint=None):
         """Run the test for a single packet size.
 
         Args:
             pkt_size (int): The packet size to test with.
             duration (int): The duration for each try.
+            hint ((float, float)): The predicted interval to start from, see
+                dats.search.create().
 
         Returns:
-            {lower_bound, upper_bound, measurement}.
-            lower_bound (long): The lower bound of the search interval.
-            upper_bound (long): The upper bound of the search interval.
-            measurement (long): The maximum value in the interval that yields
-            success.
+            {...}. The result of the search, see SearchBase.search_pkt_size(),
+            with the keys:
+            limited_by (str): What stopped the search from going higher:
+            'loss', 'latency' (see latency_exceeded()), both, or 'upper
+            bound'.
+            latency ({...}): The latency of the result, see run_test().
         """
-        precision = float(config.getOption('testPrecision'))
-
-        lower = self.lower_bound(pkt_size)
-        upper = self.upper_bound(pkt_size)
-
-        logging.info("Testing with packet size %d", pkt_size)
-
-        # Binary search assumes the lower value of the interval is
-        # successful and the upper value is a failure.
-        # The first value that is tested, is the maximum value. If that
-        # succeeds, no more searching is needed. If it fails, a regular
-        # binary search is performed.
-        # The test_value used for the first iteration of binary search
-        # is adjusted so that the delta between this test_value and the
-        # upper bound is a power-of-2 multiple of precision. In the
-        # optimistic situation where this first test_value results in a
-        # success, the binary search will complete on an integer multiple
-        # of the precision, rather than on a fraction of it.
-        adjust = precision
-        while upper - lower > adjust:
-            adjust *= 2
-        adjust = (upper - lower - adjust) / 2
-
-        test_value = upper
-
-        # throughput and packet loss from the last successfull test
-        successfull_throughput = 0
-        successfull_pkt_loss = 0
-        while upper - lower >= precision:
-            logging.verbose("New interval [%s, %s), precision: %d", lower, upper, upper - lower)
-            logging.info("Testing with value %s", test_value)
-
-            self.setup_test(pkt_size=pkt_size, speed=test_value)
-            success, throughput, pkt_loss, lat = self.run_test(pkt_size, duration, test_value)
-            self.teardown_test(pkt_size=pkt_size)
-
-            if success:
-                logging.verbose("Success! Increasing lower bound")
-                lower = test_value
-                successfull_throughput = throughput
-                successfull_pkt_loss = pkt_loss
-            else:
-                logging.verbose("Failure... Decreasing upper bound")
-                upper = test_value
-
-            test_value = lower + (upper - lower) / 2 + adjust
-            adjust = 0
-
-        successfull_throughput = round(successfull_throughput, 2)
-        self.update_kpi(dict(pkt_size=pkt_size, measurement=successfull_throughput))
-
-        return dict(
-            lower_bound=self.lower_bound(pkt_size),
-            upper_bound=self.upper_bound(pkt_size),
-            measurement=successfull_throughput,
-            pkt_loss=successfull_pkt_loss,
-            latency=lat
-        )
+        def measure(value, trial_duration):
+            success, throughput, pkt_loss, lat = self.run_test(pkt_size, trial_duration, value)
+
+            # The constraints the trial violated
+            limit = [] if success else ['loss']
+            if self.latency_exceeded(lat):
+                limit.append('latency')
+                success = False
+            return dict(success=success, limit=', '.join(limit) or None,
+                    throughput=throughput, pkt_loss=pkt_loss, latency=lat)
+
+        result, best = self.search_pkt_size(pkt_size, duration, hint, measure)
+        trials = result['trials']
+
+        # The constraint that failed the lowest failing trial above the result
+        limited_by = 'upper bound'
+        failed = [trial for trial in trials if not trial['success'] and trial['phase'] != 'repeat'
+                and (best is None or trial['value'] > best['value'])]
+        if failed:
+            limited_by = min(failed, key=lambda trial: trial['value'])['limit']
+
+        result.update(limited_by=limited_by,
+                latency=(best or trials[-1])['latency'])
+        return result
 
     @abc.abstractmethod
     def run_test(self, pkt_size, duration, value):
@@ -229,7 +199,7 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
 
     def get_cpu_id(self, cpu_map, core_id, socket_id, is_hyperthread):
         try:
-            return cpu_map[socket_id][core_id][1 if is_hyperthread else 0]
+            return cpu_map[(socket_id, core_id, 1 if is_hyperthread else 0)]
         except:
             raise Exception("Core {}{} on socket {} does not exist"
                             .format(str(core_id), "h" if is_hyperthread else "", str(socket_id)))
@@ -247,7 +217,10 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
         dats.plot.bar_plot(table, dir + prefix + 'results.png')
 
         # Generate table
+        bounded = self.latency_bounded()
         table = [['Packet size (B)', 'Throughput (Mpps)', 'Theoretical Max (Mpps)', 'Duration (s)', 'Packet loss (%)']]
+        if bounded:
+            table[0].append('Limited by')
         for result in results:
             # TODO move formatting to <typeof(measurement)>.__str__
             table.append([
@@ -257,12 +230,27 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
                 "{:.1f}".format(round(result['duration'], 1)),
                 "{:.5f}".format(round(result['pkt_loss'], 5)),
             ])
+            if bounded:
+                table[-1].append(result['limited_by'])
 
         # Generate reStructuredText report
         report = ''
         report += '.. image:: ' + prefix + 'results.png\n'
         report += '\n'
         report += rst.simple_table(table)
+        report += self.generate_repetitions_report(results)
+        report += self.generate_tolerances_report(results)
+
+        # All trials of the search, with throughput and packet loss over time
+        for result in results:
+            trials_report = self.generate_trials_report(result.get('trials', []))
+            trials_report += self.generate_drops_report(result.get('trials', []))
+            trials_report += self.generate_profile_report(result)
+            trials_report += self.generate_series_report(result.get('trials', []), prefix, dir, result['pkt_size'])
+            if trials_report:
+                report += '\n'
+                report += rst.section('Trials with packet size {}'.format(result['pkt_size']), '-')
+                report += trials_report
 
         # latency
         report += '\n\n'
@@ -304,15 +292,28 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
         return report
 
     def generate_csv(self, results):
-        csv_string = 'Packet size (B),Throughput (Mpps),Theoretical Max (Mpps),Duration (s),Packet loss (%)\n'
+        repeated = any(result.get('repetitions') for result in results)
+        bounded = self.latency_bounded()
+        csv_string = 'Packet size (B),Throughput (Mpps),Theoretical Max (Mpps),Duration (s),Packet loss (%)'
+        if bounded:
+            csv_string += ',Limited by'
+        if repeated:
+            csv_string += ',' + ','.join(column for column, _ in self.REPETITION_COLUMNS)
+        csv_string += '\n'
 
         # add data lines
         for result in results:
-            csv_string += "{},{:.2f},{:.2f},{:.1f},{:.5f}\n".format(result['pkt_size'],
-                                                                    result['measurement'],
-                                                                    round(utils.line_rate_to_pps(result['pkt_size'], 4) / 1000000, 2),
-                                                                    round(result['duration'], 1),
-                                                                    round(result['pkt_loss'], 5))
+            csv_string += "{},{:.2f},{:.2f},{:.1f},{:.5f}".format(result['pkt_size'],
+                                                                  result['measurement'],
+                                                                  round(utils.line_rate_to_pps(result['pkt_size'], 4) / 1000000, 2),
+                                                                  round(result['duration'], 1),
+                                                                  round(result['pkt_loss'], 5))
+            if bounded:
+                csv_string += ",\"{}\"".format(result['limited_by'])
+            if repeated:
+                csv_string += ',' + ','.join(self.repetition_values(result))
+            csv_string += '\n'
+        csv_string += self.generate_tolerances_csv(results)
 
         csv_string += ',\n,\n'
 
@@ -350,6 +351,13 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
             result_dict['TheoreticalMax(Mpps)'] = "{:.2f}".format(round(utils.line_rate_to_pps(result['pkt_size'], 4) / 1000000, 2))
             result_dict['Duration(s)'] = "{:.1f}".format(round(result['duration'], 1))
             result_dict['PacketLoss(%)'] = round(result['pkt_loss'], 5)
+            if self.latency_bounded():
+                result_dict['LimitedBy'] = result['limited_by']
+            if result.get('repetitions') is not None:
+                for (_, key), value in zip(self.REPETITION_COLUMNS, self.repetition_values(result)):
+                    result_dict[key] = value
+            if self.saturated_task_name(result) is not None:
+                result_dict['SaturatedTask'] = self.saturated_task_name(result)
             test_results["pkt_test_" + str(index)] = result_dict
             index += 1
 
@@ -372,4 +380,7 @@ class BinarySearchWithLatency(dats.test.base.TestBase):
 
                     test_results["lat_core_" + str(core)] = lat_result
 
+        for index, row in enumerate(self.tolerance_rows(results)):
+            test_results["pdr_test_" + str(index)] = dict(zip([key for _, key in self.TOLERANCE_COLUMNS], row))
+
         return test_results
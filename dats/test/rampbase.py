@@ -96,15 +96,24 @@ class RampBase(dats.test.base.TestBase):
         return
 
     def run_all_tests(self):
-        """Iterate over requested packet sizes and search for the maximum value that yields success.
+        """Iterate over requested packet sizes and ramp up the value for each.
+
+        With the ramp option set to 'fixed', values from start_interval() up
+        to 100 are tested in steps of step_interval(). With 'adaptive', see
+        adaptive_ramp().
 
         Returns:
-            [{...}]. An array with a dict per packet size the test has run
-            with.
+            [{...}]. An array with a dict per packet size and value the test
+            has run with.
             See run_test_with_pkt_size() for a description of the dicts. The
             following keys are added to the dicts:
             pkt_size (int): The packet size used when measuring
-            duration (float): The duration of the search in seconds
+            duration (float): The duration of the test in seconds
+            test_value (float): The value tested
+            knee (str): Only in the result at the knee, see find_knee(): what
+            happens above it, 'loss' or 'latency'
+            knee_below (str): Only in the lowest result when it is above the
+            knee already: what increases from there, 'loss'
         """
         results = []
 
@@ -116,18 +125,247 @@ class RampBase(dats.test.base.TestBase):
                 pkt_size += self.min_pkt_size() - 64
 
             logging.info("Testing with packet size %d", pkt_size)
-            test_value = self.start_interval()
             duration = float(config.getOption('testDuration'))
 
-            while test_value <= 100:
-                start_time = time.time()
-                result = self.run_test_with_pkt_size(pkt_size, duration, test_value)
-                stop_time = time.time()
-                result['pkt_size'] = pkt_size
-                result['duration'] = stop_time - start_time
-                result['test_value'] = test_value
-                results.append(result)
-                test_value = test_value + self.step_interval()
+            # Keep the traffic running between steps when the test supports it
+            sweep = bool(int(config.getOption('rampSweep'))) and self.sweep_cores() is not None
+            run_step = self.run_ramp_step
+            if sweep:
+                self.start_sweep(pkt_size, self.start_interval())
+                run_step = self.run_sweep_step
+
+            try:
+                if config.getOption('rampMode') == 'adaptive':
+                    points = self.adaptive_ramp(pkt_size, duration, run_step)
+                else:
+                    points = []
+                    test_value = self.start_interval()
+                    while test_value <= 100:
+                        points.append(run_step(pkt_size, duration, test_value))
+                        test_value = test_value + self.step_interval()
+            finally:
+                if sweep:
+                    self.stop_sweep(pkt_size)
+
+            knee, reason = self.find_knee(points)
+            if knee is not None:
+                logging.info("Knee at value %s (%.2f Mpps), above it %s increases",
+                        knee['test_value'], knee['measurement'], reason)
+                knee['knee'] = reason
+                self.update_kpi(knee)
+            elif reason is not None:
+                lowest = min(points, key=lambda result: result['test_value'])
+                logging.info("Knee below value %s, from there %s increases", lowest['test_value'], reason)
+                lowest['knee_below'] = reason
+            results += points
+
+        return results
+
+    def run_ramp_step(self, pkt_size, duration, test_value):
+        """Run a single step of the ramp.
+
+        Returns:
+            {...}. The result of run_test_with_pkt_size() with the keys
+            pkt_size, duration and test_value added.
+        """
+        start_time = time.time()
+        result = self.run_test_with_pkt_size(pkt_size, duration, test_value)
+        stop_time = time.time()
+        result['pkt_size'] = pkt_size
+        result['duration'] = stop_time - start_time
+        result['test_value'] = test_value
+        return result
+
+    # Time in seconds the traffic gets to settle after a speed change in a
+    # continuous sweep, before the measurement window starts
+    SWEEP_SETTLE_TIME = 0.5
+
+    # Time in seconds the traffic runs at the start of a continuous sweep
+    # before the first step
+    SWEEP_WARMUP_TIME = 2.0
+
+    def sweep_cores(self):
+        """Return the Tester cores generating the traffic of the ramp.
+
+        Tests that return their generator cores here are ramped up with the
+        traffic running continuously when the ramp_sweep option is set, see
+        run_sweep_step(). The default, None, restarts the traffic for every
+        step with run_test().
+
+        Returns:
+            [int]. The generator cores, or None.
+        """
+        return None
+
+    def start_sweep(self, pkt_size, test_value):
+        """Start the traffic of a continuous sweep."""
+        cores = self.sweep_cores()
+        self.setup_test(pkt_size=pkt_size, speed=test_value)
+        self._tester.stop_all()
+        self._tester.reset_stats()
+        self._tester.set_pkt_size(cores, pkt_size)
+        self._tester.set_speed(cores, test_value)
+        self._tester.start_all()
+        time.sleep(self.SWEEP_WARMUP_TIME)
+
+    def stop_sweep(self, pkt_size):
+        """Stop the traffic of a continuous sweep."""
+        self._tester.stop_all()
+        self.teardown_test(pkt_size=pkt_size)
+
+    def run_sweep_step(self, pkt_size, duration, test_value):
+        """Run a step of the ramp without restarting the traffic.
+
+        The speed of the generator cores is changed in place. Throughput and
+        packet loss are computed from the difference of the Tester counters
+        over the measurement window, tolerating the packets that may be in
+        flight at its ends. The latency is read at the start of the window,
+        which discards the samples taken at the previous speed, and at its
+        end.
+
+        Returns:
+            {...}. The same keys as run_ramp_step().
+        """
+        logging.info("Testing with value %s", test_value)
+        ports = range(self._n_ports)
+
+        start_time = time.time()
+        sampler = self.start_sampler()
+        self._tester.set_speed(self.sweep_cores(), test_value)
+        time.sleep(self.SWEEP_SETTLE_TIME)
+
+        self._tester.lat_stats(self.latency_cores())
+        start = self.snapshot(ports)
+        time.sleep(duration)
+        window = self._trial_window = self.snapshot(ports) - start
+        port_window = window.port_total()
+        lat_min, lat_max, lat_avg = self._tester.lat_stats(self.latency_cores())
+        series = self.stop_sampler(sampler)
+
+        mpps = window.tot.tx_pps() / 1000000
+
+        can_be_lost = int(port_window.tx * float(config.getOption('toleratedLoss')) / 100.0) + self.in_flight(window)
+        logging.verbose("RX: %d; TX: %d; dropped: %d (tolerated: %d)", port_window.rx, port_window.tx, port_window.lost(), can_be_lost)
+
+        success = port_window.lost() <= can_be_lost
+        if success:
+            logging.verbose("Success! Increasing lower bound")
+        else:
+            logging.verbose("Failure... Decreasing upper bound")
+
+        return dict(
+            success=success,
+            measurement=mpps,
+            pkt_loss=port_window.loss(),
+            drops=self.trial_drops(),
+            latency=dict(latency_min=lat_min, latency_max=lat_max, latency_avg=lat_avg),
+            series=series,
+            pkt_size=pkt_size,
+            duration=time.time() - start_time,
+            test_value=test_value,
+        )
+
+    def average_latency(self, result):
+        """Return the average latency in ns over the latency cores."""
+        lat_avg = result['latency']['latency_avg']
+        cores = self.latency_cores()
+        return sum(lat_avg[core] for core in cores) / len(cores)
+
+    def latency_below_knee(self, result, base_latency):
+        """Return whether a step has a latency of at most knee_latency times
+        base_latency."""
+        return self.average_latency(result) <= float(config.getOption('kneeLatency')) * base_latency
+
+    def below_knee(self, result, base_latency):
+        """Return whether a step has no packet loss beyond the tolerated loss
+        and a latency of at most knee_latency times base_latency."""
+        return result['success'] and self.latency_below_knee(result, base_latency)
+
+    def find_knee(self, results):
+        """Find the knee of the throughput/latency curve.
+
+        The knee is the highest value below the lowest value at which the
+        packet loss is not tolerated anymore, or at which the latency exceeds
+        knee_latency times the latency at the lowest value.
+
+        Args:
+            results ([{...}]): The results of the steps for one packet size.
+
+        Returns:
+            ({...}, str). The result at the knee and 'loss' or 'latency';
+            (None, 'loss') when the lowest value is above the knee already;
+            or (None, None) when all values are below the knee.
+        """
+        results = sorted(results, key=lambda result: result['test_value'])
+        if not results:
+            return None, None
+
+        base_latency = self.average_latency(results[0])
+        previous = None
+        for result in results:
+            if not self.below_knee(result, base_latency):
+                return previous, 'latency' if result['success'] else 'loss'
+            previous = result
+        return None, None
+
+    def adaptive_ramp(self, pkt_size, duration, run_step):
+        """Ramp up with coarse steps, refined around the knee.
+
+        The values from start_interval() up to 100 are first tested in steps
+        of twice step_interval(). The last value of the fixed ramp is always
+        tested. Steps are then halved, down to half of step_interval(),
+        between two values where the curve is not linear: where the packet
+        loss starts exceeding the tolerated loss, where the latency crosses
+        knee_latency times the latency at the lowest value (see find_knee()),
+        or, below the knee, where the throughput deviates by more than 5% from
+        being proportional to the value. The loss and latency transitions are
+        refined separately, so that either is refined when the other one
+        happens at a lower value.
+
+        Args:
+            pkt_size (int): The packet size to test with.
+            duration (float): The duration of each step.
+            run_step (callable): Runs a step, run_ramp_step() or
+                run_sweep_step().
+
+        Returns:
+            [{...}]. The results of the steps, see run_ramp_step(), sorted by
+            value.
+        """
+        step = self.step_interval()
+        values = []
+        test_value = self.start_interval()
+        while test_value <= 100:
+            values.append(test_value)
+            test_value = test_value + step
+        coarse = values[::2]
+        if values and coarse[-1] != values[-1]:
+            coarse.append(values[-1])
+
+        results = [run_step(pkt_size, duration, value) for value in coarse]
+        while results:
+            results.sort(key=lambda result: result['test_value'])
+            base_latency = self.average_latency(results[0])
+            refine = None
+            for low, high in zip(results, results[1:]):
+                if high['test_value'] - low['test_value'] <= step / 2:
+                    continue
+                if low['success'] != high['success'] or \
+                        self.latency_below_knee(low, base_latency) != self.latency_below_knee(high, base_latency):
+                    refine = low, high
+                    break
+                if self.below_knee(low, base_latency) and self.below_knee(high, base_latency) \
+                        and low['measurement'] > 0:
+                    expected = low['measurement'] * high['test_value'] / low['test_value']
+                    if abs(high['measurement'] - expected) > 0.05 * expected:
+                        refine = low, high
+                        break
+            if refine is None:
+                break
+
+            value = (refine[0]['test_value'] + refine[1]['test_value']) / 2
+            logging.verbose("Refining the ramp between %s and %s", refine[0]['test_value'], refine[1]['test_value'])
+            results.append(run_step(pkt_size, duration, value))
 
         return results
 
@@ -145,13 +383,20 @@ class RampBase(dats.test.base.TestBase):
             measurement (long): The maximum value in the interval that yields
             latency (dict): latency results
             success.
+            success (bool): Whether the packet loss was tolerated.
+            drops ({...}): where the lost packets were dropped, see
+            TestBase.trial_drops().
+            series ([(t, tx_mpps, rx_mpps, loss)]): rates over time, see
+            TestBase.stop_sampler().
         """
 
         logging.info("Testing with value %s", test_value)
 
+        sampler = self.start_sampler()
         self.setup_test(pkt_size=pkt_size, speed=test_value)
         success, throughput, pkt_loss, lat = self.run_test(pkt_size, duration, test_value)
         self.teardown_test(pkt_size=pkt_size)
+        series = self.stop_sampler(sampler)
 
         if success:
             logging.verbose("Success! Increasing lower bound")
@@ -159,9 +404,12 @@ class RampBase(dats.test.base.TestBase):
             logging.verbose("Failure... Decreasing upper bound")
 
         return dict(
+            success=success,
             measurement=throughput,
             pkt_loss=pkt_loss,
-            latency=lat
+            latency=lat,
+            drops=self.trial_drops(),
+            series=series
         )
 
     @abc.abstractmethod
@@ -182,7 +430,7 @@ class RampBase(dats.test.base.TestBase):
 
     def get_cpu_id(self, cpu_map, core_id, socket_id, is_hyperthread):
         try:
-            return cpu_map[socket_id][core_id][1 if is_hyperthread else 0]
+            return cpu_map[(socket_id, core_id, 1 if is_hyperthread else 0)]
         except:
             raise Exception("Core {}{} on socket {} does not exist"
                             .format(str(core_id), "h" if is_hyperthread else "", str(socket_id)))
@@ -242,6 +490,23 @@ class RampBase(dats.test.base.TestBase):
             report += rst.simple_table(table)
             report += '\n\n'
 
+            knees = [result for result in results if result['pkt_size'] == pkt_size and 'knee' in result]
+            below = [result for result in results if result['pkt_size'] == pkt_size and 'knee_below' in result]
+            if knees:
+                knee = knees[0]
+                report += "**Knee** at {}% ({:.2f} Mpps, {:.2f} ns average latency). Above it, the {} increases.\n\n".format(
+                        knee['test_value'], knee['measurement'], self.average_latency(knee), knee['knee'])
+            elif below:
+                report += "**Knee** below {}%, the lowest value tested. From there, the {} increases.\n\n".format(
+                        below[0]['test_value'], below[0]['knee_below'])
+            else:
+                report += "No knee up to the highest value.\n\n"
+
+            trials = [dict(value=result['test_value'], series=result.get('series'), drops=result.get('drops'))
+                      for result in results if result['pkt_size'] == pkt_size]
+            report += self.generate_series_report(trials, prefix, dir, pkt_size)
+            report += self.generate_drops_report(trials)
+
         return report
 
     def generate_csv(self, results):
@@ -278,6 +543,16 @@ class RampBase(dats.test.base.TestBase):
                     round(result['duration'], 1),
                     round(result['pkt_loss'], 5))
 
+            knees = [result for result in results if result['pkt_size'] == pkt_size and 'knee' in result]
+            if knees:
+                csv_string += 'Packet size (B),Knee Value (%),Throughput (Mpps),Average Latency (ns),Limited by\n'
+                csv_string += "{},{},{:.2f},{:.2f},{}\n".format(pkt_size, knees[0]['test_value'],
+                        knees[0]['measurement'], self.average_latency(knees[0]), knees[0]['knee'])
+            below = [result for result in results if result['pkt_size'] == pkt_size and 'knee_below' in result]
+            if below:
+                csv_string += 'Packet size (B),Knee Value (%),Throughput (Mpps),Average Latency (ns),Limited by\n'
+                csv_string += "{},<{},,,{}\n".format(pkt_size, below[0]['test_value'], below[0]['knee_below'])
+
             csv_string += ",\n,\n"
 
         return csv_string
@@ -315,4 +590,13 @@ class RampBase(dats.test.base.TestBase):
                 test_results["rmp_test_" + str(index)] = result_dict
                 index += 1
 
+                if 'knee' in result:
+                    test_results["knee_" + str(pkt_size)] = dict(result_dict, LimitedBy=result['knee'])
+                if 'knee_below' in result:
+                    test_results["knee_" + str(pkt_size)] = {
+                        'PacketSize(B)': result_dict['PacketSize(B)'],
+                        'KneeBelow(%)': result_dict['TestValue(%)'],
+                        'LimitedBy': result['knee_below'],
+                    }
+
         return test_results
@@ -0,0 +1,548 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+The base class for the tests that search for the highest value that yields
+success.
+
+The searches themselves are implemented in dats.search. This class runs them
+for every packet size, with the trials going through the trial store, and
+generates the parts of the report that are shared by all search tests: the
+trials, the repetitions of the result, the result per tolerated packet loss
+and the SUT task profile.
+"""
+
+import abc
+import time
+import logging
+
+import dats.test.base
+import dats.config as config
+import dats.search
+import dats.rstgen as rst
+
+
+class SearchBase(dats.test.base.TestBase):
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        """Initialize the test object.
+        """
+        super(SearchBase, self).__init__()
+
+    def early_abort(self):
+        return bool(int(config.getOption('earlyAbort')))
+
+    def profile_tasks(self):
+        return bool(int(config.getOption('profileTasks')))
+
+    def trial_succeeds(self, trial, tolerated_loss):
+        """Return whether a trial succeeds with a tolerated packet loss.
+
+        The test itself decides on success with tolerated_loss from the config
+        file. With other tolerated losses, only the packet loss is checked.
+
+        Args:
+            trial ({...}): The trial, with the keys 'success' and 'pkt_loss'.
+            tolerated_loss (float): The tolerated packet loss in %.
+
+        Returns:
+            bool. True if the trial succeeds.
+        """
+        if tolerated_loss == float(config.getOption('toleratedLoss')):
+            return trial['success']
+        return trial['pkt_loss'] <= tolerated_loss
+
+    # A task counts as saturated at the NDR if its receive rate there is at
+    # least this ratio of the highest one it reached in the search
+    SATURATED_BUSY_RATIO = 0.95
+
+    def task_profile(self, best, trials):
+        """Find the SUT task that limits the throughput at the NDR.
+
+        The busy ratio of a task is its receive rate at the NDR, relative to
+        the highest receive rate it reached in any trial of the search. The
+        trials above the NDR overload the SUT, so a task whose receive rate
+        did not grow beyond the one at the NDR could not handle more packets.
+        The tasks behind it are capped by it too, so the saturated task is
+        the first task, in the order of sut_tasks(), with a busy ratio of at
+        least SATURATED_BUSY_RATIO. There is none when every task still
+        handled more packets above the NDR.
+
+        Args:
+            best ({...}): The trial at the NDR, with the key 'profile', see
+                trial_profile().
+            trials ([{...}]): All trials of the search.
+
+        Returns:
+            ([{...}], (int, int)). A row for each task, in the order of
+            sut_tasks(), with keys 'task' (core, task), 'rx', 'tx', 'drop' (in
+            Mpps at the NDR) and 'busy' (ratio), and the saturated task, or
+            None if no task is saturated. ([], None) if the trial at the NDR
+            was not profiled.
+        """
+        if best is None or not best.get('profile'):
+            return [], None
+
+        profile = best['profile']
+        rows = []
+        for task in self.sut_tasks():
+            if task not in profile:
+                continue
+            peak = max(trial['profile'][task]['rx'] for trial in trials
+                    if trial.get('profile') and task in trial['profile'])
+            row = dict(profile[task], task=task)
+            row['busy'] = row['rx'] / peak if peak > 0 else 0.0
+            rows.append(row)
+        if not rows:
+            return [], None
+
+        saturated = next((row['task'] for row in rows
+                if row['busy'] >= self.SATURATED_BUSY_RATIO), None)
+        return rows, saturated
+
+    def generate_profile_report(self, result):
+        """Generate a table of the SUT tasks at the NDR.
+
+        Args:
+            result ({...}): A search result with the keys 'task_profile' and
+                'saturated_task', see task_profile().
+
+        Returns:
+            str. reStructuredText with the table, or an empty string if the
+            tasks were not profiled.
+        """
+        rows = result.get('task_profile')
+        if not rows:
+            return ''
+
+        table = [['Core', 'Task', 'RX (Mpps)', 'TX (Mpps)', 'Drop (Mpps)', 'Busy (%)']]
+        for row in rows:
+            table.append([
+                row['task'][0],
+                row['task'][1],
+                "{:.3f}".format(row['rx']),
+                "{:.3f}".format(row['tx']),
+                "{:.3f}".format(row['drop']),
+                "{:.0f}".format(row['busy'] * 100),
+            ])
+
+        report = '\n'
+        report += rst.section('Task profile at the NDR', '~')
+        report += rst.simple_table(table)
+        report += '\n'
+        report += "**Saturated task**: {}.\n\n".format(self.saturated_task_name(result))
+        return report
+
+    def saturated_task_name(self, result):
+        """Return the saturated task of a search result as text.
+
+        Returns:
+            str. 'core X, task Y', or 'none' if no task is saturated. None if
+            the tasks were not profiled.
+        """
+        if not result.get('task_profile'):
+            return None
+        if result.get('saturated_task') is None:
+            return 'none'
+        return "core {}, task {}".format(*result['saturated_task'])
+
+    def run_all_tests(self):
+        """Iterate over requested packet sizes and search for the maximum value that yields success.
+
+        The search of each packet size is run by run_test_with_pkt_size() of
+        the test, see search_pkt_size(). Its result goes through the trial
+        store, see stored().
+
+        Returns:
+            [{...}]. An array with a dict per packet size the test has run
+            with.
+            See search_pkt_size() for a description of the dicts. The
+            following keys are added to the dicts:
+            pkt_size (int): The packet size used when measuring
+            duration (float): The duration of the search in seconds
+        """
+        results = []
+        previous = None
+
+        pkt_sizes = map(int, config.getOption('pktSizes').split(','))
+        for pkt_size in pkt_sizes:
+            # Adjust packet size upwards if it's less than the minimum
+            # required packet size for the test.
+            if pkt_size < self.min_pkt_size():
+                pkt_size += self.min_pkt_size() - 64
+
+            # Start from the interval predicted by the last result
+            hint = None
+            if previous is not None and int(config.getOption('warmStart')):
+                hint = dats.search.predict_interval(previous['value'], previous['pkt_size'], pkt_size,
+                        self.lower_bound(pkt_size), self.upper_bound(pkt_size),
+                        float(config.getOption('testPrecision')))
+
+            # time duration of a single step
+            duration = float(config.getOption('testDuration'))
+
+            def search():
+                start_time = time.time()
+                result = self.run_test_with_pkt_size(pkt_size, duration, hint)
+                stop_time = time.time()
+                result['pkt_size'] = pkt_size
+                result['duration'] = stop_time - start_time
+                return result
+
+            result = self.stored('result', dict(pkt_size=pkt_size, duration=duration,
+                    precision=config.getOption('testPrecision'),
+                    coarse_duration=config.getOption('coarseDuration'),
+                    search=config.getOption('searchStrategy'),
+                    repeat=[config.getOption(option) for option in
+                        ('repeat', 'repeatNeighbours', 'ciWidth', 'confidence')]), search)
+            self.update_kpi(dict(pkt_size=pkt_size, measurement=result['measurement']))
+
+            results.append(result)
+            if result['value'] is not None:
+                previous = result
+
+        return results
+
+    def search_pkt_size(self, pkt_size, duration, hint, measure):
+        """Search for the maximum value that yields success for a packet size.
+
+        Every trial runs between setup_test() and teardown_test(), with the
+        Tester counters sampled in the background, and goes through the trial
+        store. One search runs per tolerated packet loss, see
+        tolerated_losses(), all sharing the same trials. With a coarse
+        duration, the candidates are found with short trials and confirmed
+        with trials of the full duration. The trial of the result is then
+        repeated, see dats.search.repeat().
+
+        Args:
+            pkt_size (int): The packet size to test with.
+            duration (float): The duration for each try.
+            hint ((float, float)): The predicted interval to start from, see
+                dats.search.create().
+            measure (callable): Runs the test with the value and the trial
+                duration passed as arguments. Returns a dict with at least
+                the keys 'success', 'throughput' and 'pkt_loss', and any
+                other keys the test records of a trial.
+
+        Returns:
+            ({...}, {...}). The result of the search, and the trial of the
+            result (None if no trial succeeded). The result has the keys:
+            lower_bound (long): The lower bound of the search interval.
+            upper_bound (long): The upper bound of the search interval.
+            measurement (long): The throughput of the highest successful
+            trial.
+            value (float): The highest value that yields success, or None.
+            pkt_loss (float): The packet loss of the highest successful
+            trial.
+            trials ([{...}]): The keys returned by measure, value, aborted
+            (the time after which the trial was ended early, or None),
+            phase ('coarse', 'fine' or 'repeat'), duration, the rate time
+            series (see stop_sampler()), the drops (see trial_drops()) and
+            the task profile (see trial_profile()) of every trial.
+            repetitions ({...}): The statistics of the throughput of the
+            repeated trials of the result, see dats.search.repeat(), or None
+            when trials are not repeated.
+            tolerances ([{...}]): tolerated_loss, value, measurement and
+            pkt_loss of the result for each tolerated packet loss.
+            task_profile ([{...}]), saturated_task ((int, int)): The SUT
+            tasks at the NDR and the one that limits the throughput, see
+            task_profile().
+        """
+        precision = float(config.getOption('testPrecision'))
+
+        lower = self.lower_bound(pkt_size)
+        upper = self.upper_bound(pkt_size)
+
+        logging.info("Testing with packet size %d", pkt_size)
+
+        def trial(value, trial_duration, phase):
+            sampler = self.start_sampler()
+            self.setup_test(pkt_size=pkt_size, speed=value)
+            result = measure(value, trial_duration)
+            self.teardown_test(pkt_size=pkt_size)
+            result.update(value=value, phase=phase, duration=trial_duration,
+                    aborted=self._trial_aborted,
+                    drops=self.trial_drops(),
+                    profile=self.trial_profile(),
+                    series=self.stop_sampler(sampler))
+            return result
+
+        def stored_trial(value, trial_duration, phase, run=0):
+            params = dict(pkt_size=pkt_size, value=value, duration=trial_duration)
+            if run:
+                params['run'] = run
+            return self.stored('trial', params, lambda: trial(value, trial_duration, phase))
+
+        def run_search(searches, trial_duration, phase):
+            return dats.search.run_all(searches,
+                    lambda value: stored_trial(value, trial_duration, phase), self.trial_succeeds)
+
+        # One search per tolerated packet loss, all sharing the same trials
+        tolerated_loss = float(config.getOption('toleratedLoss'))
+        searches = [dats.search.create(lower, upper, precision, hint if loss == tolerated_loss else None, loss)
+                for loss in self.tolerated_losses()]
+        coarse_duration = float(config.getOption('coarseDuration'))
+        if 0 < coarse_duration < duration:
+            # Find the candidates with short trials, then confirm them with
+            # trials of the full duration, stepping down while they fail.
+            candidates, trials = run_search(searches, coarse_duration, 'coarse')
+            bests = dict((loss, None) for loss in candidates)
+            confirms = [dats.search.StepDown(lower, search.upper, precision, search.tolerated_loss,
+                    candidates[search.tolerated_loss]['value'])
+                    for search in searches if candidates[search.tolerated_loss] is not None]
+            if confirms:
+                logging.info("Confirming values %s with %s s trials",
+                        ', '.join(str(candidates[confirm.tolerated_loss]['value']) for confirm in confirms), duration)
+                confirmed, fine_trials = run_search(confirms, duration, 'fine')
+                bests.update(confirmed)
+                trials += fine_trials
+        else:
+            bests, trials = run_search(searches, duration, 'fine')
+        best = bests[tolerated_loss]
+        logging.verbose("Search finished after %d trials", len(trials))
+
+        # Repeat the trial of the result to see how much its throughput varies
+        repetitions = None
+        max_runs = int(config.getOption('repeat'))
+        if best is not None and max_runs > 1:
+            neighbours = []
+            if int(config.getOption('repeatNeighbours')):
+                neighbours = [value for value in (best['value'] - precision, best['value'] + precision)
+                        if lower <= value <= upper]
+            repetitions, repeat_trials = dats.search.repeat(
+                    lambda value, run: stored_trial(value, duration, 'repeat', run),
+                    best, max_runs, float(config.getOption('ciWidth')),
+                    int(config.getOption('confidence')), neighbours)
+            trials += repeat_trials
+
+        # throughput and packet loss from the highest successful test
+        successfull_throughput = 0
+        successfull_pkt_loss = 0
+        if best is not None:
+            successfull_throughput = best['throughput']
+            successfull_pkt_loss = best['pkt_loss']
+
+        successfull_throughput = round(successfull_throughput, 2)
+
+        # The SUT task that limits the throughput
+        task_profile, saturated_task = self.task_profile(best, trials)
+        if saturated_task is not None:
+            logging.info("Saturated task at the NDR: core %d, task %d", *saturated_task)
+        elif task_profile:
+            logging.info("No saturated task at the NDR")
+
+        # The result for every tolerated packet loss
+        tolerances = []
+        for loss in sorted(bests):
+            result = bests[loss] or dict(value=None, throughput=0, pkt_loss=0)
+            tolerances.append(dict(tolerated_loss=loss, value=result['value'],
+                    measurement=round(result['throughput'], 2), pkt_loss=result['pkt_loss']))
+
+        return dict(
+            lower_bound=lower,
+            upper_bound=upper,
+            measurement=successfull_throughput,
+            value=best['value'] if best is not None else None,
+            pkt_loss=successfull_pkt_loss,
+            repetitions=repetitions,
+            tolerances=tolerances,
+            task_profile=task_profile,
+            saturated_task=saturated_task,
+            trials=trials
+        ), best
+
+    def generate_trials_report(self, trials):
+        """Generate a table of the trials of a search.
+
+        Args:
+            trials ([{...}]): Trials with keys 'phase', 'value', 'duration',
+                'aborted', 'success', 'throughput' and 'pkt_loss', and
+                optionally 'limit', the constraints a failed trial violated.
+
+        Returns:
+            str. reStructuredText with the table, or an empty string if there
+            are no trials.
+        """
+        if not trials:
+            return ''
+
+        table = [['Phase', 'Value (%)', 'Duration (s)', 'Result', 'Throughput (Mpps)', 'Packet loss (%)']]
+        for trial in trials:
+            duration = "{:.1f}".format(trial['duration'])
+            if trial.get('aborted') is not None:
+                duration = "{:.1f} of {}".format(trial['aborted'], duration)
+            outcome = 'pass' if trial['success'] else 'fail'
+            if not trial['success'] and trial.get('limit'):
+                outcome += ' ({})'.format(trial['limit'])
+            table.append([
+                trial.get('phase', ''),
+                "{:.2f}".format(trial['value']),
+                duration,
+                outcome,
+                "{:.2f}".format(trial['throughput']),
+                "{:.5f}".format(trial['pkt_loss']),
+            ])
+        return rst.simple_table(table)
+
+    # Columns of the report, CSV and JSON with the statistics of repeated
+    # trials, see repetition_values()
+    REPETITION_COLUMNS = (
+        ('Runs', 'Runs'),
+        ('Mean (Mpps)', 'MeanThroughput(Mpps)'),
+        ('Stddev (Mpps)', 'StddevThroughput(Mpps)'),
+        ('CI low (Mpps)', 'ConfidenceLow(Mpps)'),
+        ('CI high (Mpps)', 'ConfidenceHigh(Mpps)'),
+        ('Pass rate (%)', 'PassRate(%)'),
+    )
+
+    def repetition_values(self, result):
+        """Return the formatted statistics of the repeated trials of a result.
+
+        Args:
+            result ({...}): A search result with the key 'repetitions', see
+                dats.search.repeat().
+
+        Returns:
+            [str]. A value per column of REPETITION_COLUMNS, or empty strings
+            if the trials of the result were not repeated.
+        """
+        stats = result.get('repetitions')
+        if stats is None:
+            return [''] * len(self.REPETITION_COLUMNS)
+        return [
+            "{}".format(stats['n']),
+            "{:.2f}".format(stats['mean']),
+            "{:.3f}".format(stats['stddev']),
+            "{:.2f}".format(stats['ci_low']),
+            "{:.2f}".format(stats['ci_high']),
+            "{:.0f}".format(stats['pass_rate'] * 100),
+        ]
+
+    def generate_repetitions_report(self, results):
+        """Generate a table of the statistics of repeated trials.
+
+        Args:
+            results ([{...}]): Search results with the keys 'pkt_size' and
+                'repetitions'.
+
+        Returns:
+            str. reStructuredText with the table, or an empty string if no
+            trials were repeated.
+        """
+        if not any(result.get('repetitions') for result in results):
+            return ''
+
+        table = [['Packet size (B)'] + [column for column, _ in self.REPETITION_COLUMNS]
+                + ['Neighbours pass rate (%)']]
+        for result in results:
+            neighbours = (result.get('repetitions') or {}).get('neighbours', [])
+            table.append([result['pkt_size']] + self.repetition_values(result) + [
+                ', '.join("{:.2f}: {:.0f}".format(n['value'], n['pass_rate'] * 100) for n in neighbours)])
+
+        report = '\n'
+        report += rst.section('Repeated trials ({}% confidence interval)'.format(config.getOption('confidence')), '-')
+        report += rst.simple_table(table)
+        return report
+
+    # Columns of the report, CSV and JSON with the result per tolerated packet
+    # loss, see tolerance_rows()
+    TOLERANCE_COLUMNS = (
+        ('Packet size (B)', 'PacketSize(B)'),
+        ('Rate', 'Rate'),
+        ('Tolerated loss (%)', 'ToleratedLoss(%)'),
+        ('Value (%)', 'Value(%)'),
+        ('Throughput (Mpps)', 'Throughput(Mpps)'),
+        ('Packet loss (%)', 'PacketLoss(%)'),
+    )
+
+    def tolerance_rows(self, results):
+        """Return the formatted results per tolerated packet loss.
+
+        Args:
+            results ([{...}]): Search results with the keys 'pkt_size' and
+                'tolerances'.
+
+        Returns:
+            [[str]]. A row per packet size and tolerated loss with a value per
+            column of TOLERANCE_COLUMNS, or no rows if the searches only had
+            one tolerated loss.
+        """
+        rows = []
+        for result in results:
+            tolerances = result.get('tolerances', [])
+            if len(tolerances) < 2:
+                continue
+            for tolerance in tolerances:
+                rows.append([
+                    "{}".format(result['pkt_size']),
+                    'NDR' if tolerance['tolerated_loss'] == 0 else 'PDR',
+                    "{:g}".format(tolerance['tolerated_loss']),
+                    "{:.2f}".format(tolerance['value']) if tolerance['value'] is not None else '',
+                    "{:.2f}".format(tolerance['measurement']),
+                    "{:.5f}".format(round(tolerance['pkt_loss'], 5)),
+                ])
+        return rows
+
+    def generate_tolerances_report(self, results):
+        """Generate a table of the results per tolerated packet loss.
+
+        Returns:
+            str. reStructuredText with the table, or an empty string if the
+            searches only had one tolerated loss.
+        """
+        rows = self.tolerance_rows(results)
+        if not rows:
+            return ''
+
+        report = '\n'
+        report += rst.section('Throughput per tolerated packet loss', '-')
+        report += rst.simple_table([[column for column, _ in self.TOLERANCE_COLUMNS]] + rows)
+        return report
+
+    def generate_tolerances_csv(self, results):
+        """Generate CSV lines with the results per tolerated packet loss.
+
+        Returns:
+            str. A separator and the CSV header and rows, or an empty string
+            if the searches only had one tolerated loss.
+        """
+        rows = self.tolerance_rows(results)
+        if not rows:
+            return ''
+
+        csv_string = ',\n,\n'
+        csv_string += ','.join(column for column, _ in self.TOLERANCE_COLUMNS) + '\n'
+        for row in rows:
+            csv_string += ','.join(row) + '\n'
+        return csv_string
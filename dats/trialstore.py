@@ -0,0 +1,96 @@
+#
+# Dataplane Automated Testing System
+#
+# Copyright (c) 2015-2016, Intel Corporation.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#   * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#   * Neither the name of Intel Corporation nor the names of its
+#     contributors may be used to endorse or promote products derived
+#     from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Persistent store of trial results.
+
+Every trial of a search, and the result of the search for each packet size,
+is stored on disk as soon as it completes. A run started with --resume reuses
+the stored results instead of measuring them again. Results are stored under
+a key that covers everything they depend on; see TestBase.run_context().
+"""
+
+import os
+import os.path as path
+import hashlib
+import json
+import shelve
+import threading
+import logging
+
+import dats.config as config
+
+
+class TrialStore(object):
+    def __init__(self, filename):
+        """Open the store, creating it if needed.
+
+        Args:
+            filename (str): The base name of the files of the store.
+        """
+        if not path.isdir(path.dirname(filename) or '.'):
+            os.makedirs(path.dirname(filename))
+        self._db = shelve.open(filename, protocol=2)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        with self._lock:
+            return self._db.get(key)
+
+    def put(self, key, value):
+        """Store value under key and write it to disk right away."""
+        with self._lock:
+            self._db[key] = value
+            self._db.sync()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def make_key(*parts):
+    """Return a store key for the JSON-serializable parts."""
+    return hashlib.md5(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+_store = None
+
+def get_store():
+    """Return the trial store in the cache directory from the config file."""
+    global _store
+    if _store is None:
+        filename = path.join(config.getOption('cacheDir'), 'trials')
+        logging.debug("Opening trial store %s", filename)
+        _store = TrialStore(filename)
+    return _store
@@ -40,3 +40,46 @@ def calc_line_rate(arr, n_ports = 1):
 def line_rate_to_pps(pkt_size, n_ports):
     # FIXME Don't hardcode 10Gb/s
     return n_ports * float(10000000000 / 8) / (pkt_size + 20)
+
+# Two-sided Student t quantiles for 1 to 30 degrees of freedom, and the normal
+# quantile used for more degrees of freedom
+_t_quantiles = {
+    90: ([6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812,
+          1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725,
+          1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697], 1.645),
+    95: ([12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+          2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+          2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042], 1.960),
+    99: ([63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169,
+          3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861, 2.845,
+          2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750], 2.576),
+}
+
+def sample_stats(samples, confidence=95):
+    """Return the mean, standard deviation and confidence interval of samples.
+
+    Args:
+        samples ([float]): The measurements.
+        confidence (int): Confidence level of the interval in percent, one of
+            90, 95 and 99.
+
+    Returns:
+        {n, mean, stddev, ci_low, ci_high}. The interval is based on the
+        Student t distribution. It is (mean, mean) for a single sample.
+    """
+    if confidence not in _t_quantiles:
+        raise ValueError("Unsupported confidence level {}, use one of {}".format(
+                confidence, sorted(_t_quantiles.keys())))
+
+    n = len(samples)
+    mean = float(sum(samples)) / n
+    stddev = 0.0
+    half_width = 0.0
+    if n > 1:
+        stddev = (sum((s - mean) ** 2 for s in samples) / (n - 1)) ** 0.5
+        table, normal = _t_quantiles[confidence]
+        t = table[n - 2] if n - 1 <= len(table) else normal
+        half_width = t * stddev / n ** 0.5
+
+    return dict(n=n, mean=mean, stddev=stddev,
+            ci_low=mean - half_width, ci_high=mean + half_width)
@@ -65,18 +65,23 @@ class AccessControlList(dats.test.binsearch.BinarySearch):
 
     def setup_class(self):
         self._tester_cpu_map = self.get_remote('tester').get_cpu_topology()
+        self._sut_cpu_map = self.get_remote('sut').get_cpu_topology()
         self.get_remote('tester').copy_extra_config("parameters.lua")
-        self.get_remote('sut').copy_extra_config("parameters.lua")
-        self._tester = self.get_remote('tester').run_prox_with_config("gen_acl-4.cfg", "-e -t", "Tester")
 
-        self._sut = self.get_remote('sut')
-        self._sut.copy_extra_config("acl_rules-2.lua")
+        self.get_remote('sut').copy_extra_config("parameters.lua", "acl_rules-2.lua")
 
-        self._sut.run_prox_with_config("handle_acl-4.cfg", "-t", "SUT")
+        self._tester, self._sut = self.start_prox("gen_acl-4.cfg", "-e -t", "handle_acl-4.cfg", "-t")
 
     def teardown_class(self):
         pass
 
+    def sut_cores(self):
+        socket_id = int(config.getOption("sutSocketId"))
+        return [self.get_cpu_id(self._sut_cpu_map, core, socket_id, False) for core in range(1, 5)]
+
+    def sut_tasks(self):
+        return [(core, task) for core in self.sut_cores() for task in (0, 1)]
+
     def run_test(self, pkt_size, duration, value):
         cores = [
             self.get_cpu_id(self._tester_cpu_map, 1, int(config.getOption("testerSocketId")), False),
@@ -92,28 +97,19 @@ class AccessControlList(dats.test.binsearch.BinarySearch):
         self._tester.start_all()
 
         # Getting statistics to calculate PPS at right speed....
-        tsc_hz = self._tester.hz()
         sleep(2)
-        rx_start, tx_start, tsc_start = self._tester.tot_stats()
-        sleep(duration)
-        # Get stats before stopping the cores. Stopping cores takes some time
-        # and might skew results otherwise.
-        rx_stop, tx_stop, tsc_stop = self._tester.tot_stats()
+        window = self.measure_trial(duration, ports=[0, 1, 2, 3])
         self._tester.stop_all()
 
-        port_stats = self._tester.port_stats([0, 1, 2, 3])
-        rx_total = port_stats[6]
-        tx_total = port_stats[7]
+        ports = window.port_total()
 
-        can_be_lost = int(tx_total * float(config.getOption('toleratedLoss')) / 100.0)
-        logging.verbose("RX: %d; TX: %d; dropped: %d (tolerated: %d)", rx_total, tx_total, tx_total - rx_total, can_be_lost)
+        can_be_lost = int(ports.tx * float(config.getOption('toleratedLoss')) / 100.0) + self.in_flight(window)
+        logging.verbose("RX: %d; TX: %d; dropped: %d (tolerated: %d)", ports.rx, ports.tx, ports.lost(), can_be_lost)
 
         # calculate the effective throughput in Mpps
-        tx = tx_stop - tx_start
-        tsc = tsc_stop - tsc_start
-        mpps = tx / (tsc/float(tsc_hz)) / 1000000
+        mpps = window.tot.tx_pps() / 1000000
 
         pps = (value / 100.0) * utils.line_rate_to_pps(pkt_size, 4)
         logging.verbose("Mpps configured: %f; Mpps effective %f", (pps/1000000.0), mpps)
 
-        return (tx_total - rx_total <= can_be_lost), mpps, 100.0*(tx_total - rx_total)/float(tx_total)
+        return ports.lost() <= can_be_lost, mpps, ports.loss()
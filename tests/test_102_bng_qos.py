@@ -67,16 +67,13 @@ class BNG_QoS(dats.test.binsearch.BinarySearch):
 
     def setup_class(self):
         self._tester_cpu_map = self.get_remote('tester').get_cpu_topology()
+        self._sut_cpu_map = self.get_remote('sut').get_cpu_topology()
         self.get_remote('tester').copy_extra_config("parameters.lua")
-        self.get_remote('sut').copy_extra_config("parameters.lua")
-        self._tester = self.get_remote('tester').run_prox_with_config("gen_bng_qos-4.cfg", "-e -t", "Tester")
 
         sut = self.get_remote('sut')
-        sut.copy_extra_config("gre_table.lua")
-        sut.copy_extra_config("ipv4.lua")
-        sut.copy_extra_config("dscp.lua")
+        sut.copy_extra_config("parameters.lua", "gre_table.lua", "ipv4.lua", "dscp.lua")
 
-        self._sut = sut.run_prox_with_config("handle_bng_qos-4.cfg", "-t", "SUT")
+        self._tester, self._sut = self.start_prox("gen_bng_qos-4.cfg", "-e -t", "handle_bng_qos-4.cfg", "-t")
 
         # These should go to the configuration file and eventually should be
         # autoprobed.
@@ -112,6 +109,24 @@ class BNG_QoS(dats.test.binsearch.BinarySearch):
         pass
 
 
+    def sut_cores(self):
+        socket_id = int(config.getOption("sutSocketId"))
+        return [self.get_cpu_id(self._sut_cpu_map, core, socket_id, hyperthread)
+                for hyperthread in (False, True) for core in range(1, 10)]
+
+    def sut_tasks(self):
+        socket_id = int(config.getOption("sutSocketId"))
+        def cpu_ids(cores):
+            return [self.get_cpu_id(self._sut_cpu_map, core, socket_id, hyperthread)
+                    for core in cores for hyperthread in (False, True)]
+        # Load balancers, workers, then QoS
+        return ([(core, 0) for core in cpu_ids(range(1, 3))]
+                + [(core, task) for core in cpu_ids(range(7, 10)) for task in (0, 1)]
+                + [(core, 0) for core in cpu_ids(range(3, 7))])
+
+    def latency_cores(self):
+        return self._rx_lat_cores
+
     # Initialization before the test proper consists of two parts:
     # - ARP: The tables of the SUT are initialized by ARP packets. 4 seconds
     #       will be sent before the test starts, so the tables are already
@@ -203,32 +218,19 @@ class BNG_QoS(dats.test.binsearch.BinarySearch):
         # amount of time and calculate packet loss.
 
         # Getting statistics to calculate PPS at right speed....
-        tsc_hz = self._tester.hz()
-        rx_start, tx_start, tsc_start = self._tester.tot_stats()
-        sleep(duration)
-        # Get stats before stopping the cores. Stopping cores takes some time
-        # and might skew results otherwise.
-        rx_stop, tx_stop, tsc_stop = self._tester.tot_stats()
+        window = self.measure_trial(duration, cores=self._all_stats_cores)
         # TODO report latency?
         lat_min, lat_max, lat_avg = self._tester.lat_stats(self._rx_lat_cores)
 
         self._tester.stop(self._arp_cores + self._cpe_cores + self._inet_cores)
-        # flush packets in NIC RX buffers so they are counted too when
-        # when calculating the number of dropped packets.
-        logging.verbose("Test ended. Flushing NIC buffers")
-        self._tester.start(self._all_rx_cores)
-        sleep(3)
-        self._tester.stop(self._all_rx_cores)
 
         # calculate the effective throughput in Mpps
-        rx = rx_stop - rx_start
-        tsc = tsc_stop - tsc_start
-        mpps = rx / (tsc/float(tsc_hz)) / 1000000
+        mpps = window.tot.rx_pps() / 1000000
         logging.verbose("MPPS: %f", mpps)
 
-        rx_tot, tx_tot, drop_tot, _ = self._tester.rx_stats(self._all_stats_cores)
+        cores = window.core_total()
 
-        can_be_lost = int(tx_tot * float(config.getOption('toleratedLoss')) / 100.0)
-        logging.verbose("RX: %d; TX: %d; drop: %d; TX-RX: %d (tolerated: %d)", rx_tot, tx_tot, drop_tot, tx_tot - rx_tot, can_be_lost)
+        can_be_lost = int(cores.tx * float(config.getOption('toleratedLoss')) / 100.0) + self.in_flight(window)
+        logging.verbose("RX: %d; TX: %d; drop: %d; TX-RX: %d (tolerated: %d)", cores.rx, cores.tx, cores.drop, cores.lost(), can_be_lost)
 
-        return (tx_tot - rx_tot <= can_be_lost), mpps, 100.0*(tx_tot - rx_tot)/float(tx_tot)
+        return cores.lost() <= can_be_lost, mpps, cores.loss()
@@ -68,14 +68,12 @@ class lw_AFTR(dats.test.binsearch.BinarySearch):
 
     def setup_class(self):
         self._tester_cpu_map = self.get_remote('tester').get_cpu_topology()
+        self._sut_cpu_map = self.get_remote('sut').get_cpu_topology()
         self.get_remote('tester').copy_extra_config("parameters.lua")
-        self.get_remote('sut').copy_extra_config("parameters.lua")
-        self._tester = self.get_remote('tester').run_prox_with_config("gen_lw_AFTR.cfg", "-e -t", "Tester")
 
-        self._sut = self.get_remote('sut')
-        self._sut.copy_extra_config("ip6_tun_bind_65k.lua")
+        self.get_remote('sut').copy_extra_config("parameters.lua", "ip6_tun_bind_65k.lua")
 
-        self._sut.run_prox_with_config("handle_lw_AFTR.cfg", "-t", "SUT")
+        self._tester, self._sut = self.start_prox("gen_lw_AFTR.cfg", "-e -t", "handle_lw_AFTR.cfg", "-t")
 
         # These should go to the configuration file and eventually should be autoprobed.
         self._cpe_ports = [1, 3]
@@ -112,6 +110,16 @@ class lw_AFTR(dats.test.binsearch.BinarySearch):
     def teardown_class(self):
         pass
 
+    def sut_cores(self):
+        socket_id = int(config.getOption("sutSocketId"))
+        return [self.get_cpu_id(self._sut_cpu_map, core, socket_id, False) for core in range(1, 5)]
+
+    def sut_tasks(self):
+        return [(core, task) for core in self.sut_cores() for task in (0, 1)]
+
+    def latency_cores(self):
+        return self._rx_lat_cores
+
     def setup_test(self, pkt_size, speed):
         # Calculate the target upload and download speed. The upload and
         # download packets have different packet sizes, so in order to get
@@ -193,32 +201,19 @@ class lw_AFTR(dats.test.binsearch.BinarySearch):
         # amount of time and calculate packet loss.
 
         # Getting statistics to calculate PPS at right speed....
-        tsc_hz = self._tester.hz()
-        rx_start, tx_start, tsc_start = self._tester.tot_stats()
-        sleep(duration)
-        # Get stats before stopping the cores. Stopping cores takes some time
-        # and might skew results otherwise.
-        rx_stop, tx_stop, tsc_stop = self._tester.tot_stats()
+        window = self.measure_trial(duration, cores=self._all_stats_cores)
         # report latency
         lat_min, lat_max, lat_avg = self._tester.lat_stats(self._rx_lat_cores)
 
         self._tester.stop(self._cpe_cores + self._inet_cores)
-        # flush packets in NIC RX buffers so they are counted too when
-        # when calculating the number of dropped packets.
-        logging.verbose("Test ended. Flushing NIC buffers")
-        self._tester.start(self._all_rx_cores)
-        sleep(3)
-        self._tester.stop(self._all_rx_cores)
 
         # calculate the effective throughput in Mpps
-        rx = rx_stop - rx_start
-        tsc = tsc_stop - tsc_start
-        mpps = rx / (tsc/float(tsc_hz)) / 1000000
+        mpps = window.tot.rx_pps() / 1000000
         logging.verbose("MPPS: %f", mpps)
 
-        rx_tot, tx_tot, drop_tot, _ = self._tester.rx_stats(self._all_stats_cores)
+        cores = window.core_total()
 
-        can_be_lost = int(tx_tot * float(config.getOption('toleratedLoss')) / 100.0)
-        logging.verbose("RX: %d; TX: %d; drop: %d; TX-RX: %d (tolerated: %d)", rx_tot, tx_tot, drop_tot, tx_tot - rx_tot, can_be_lost)
+        can_be_lost = int(cores.tx * float(config.getOption('toleratedLoss')) / 100.0) + self.in_flight(window)
+        logging.verbose("RX: %d; TX: %d; drop: %d; TX-RX: %d (tolerated: %d)", cores.rx, cores.tx, cores.drop, cores.lost(), can_be_lost)
 
-        return (tx_tot - rx_tot <= can_be_lost), mpps, 100.0*(tx_tot - rx_tot)/float(tx_tot)
+        return cores.lost() <= can_be_lost, mpps, cores.loss()